@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+Throughput benchmark of the time stretching chain of Play it Slowly.
+
+Builds the chain the playback pipeline uses (pitch ! audioconvert) behind
+audiotestsrc, or behind uridecodebin for --file, and in front of
+"fakesink sync=false", so it runs as fast as possible and needs no audio
+device. For every combination of tempo and pitch it reports:
+
+- realtime_factor: seconds of output produced per second of wall time
+- cpu_seconds and cpu_percent: CPU time of the process (all threads)
+- streams: output seconds per CPU second, roughly how many streams at that
+  setting a single core sustains in realtime
+
+Usage: python3 benchmarks/bench_pipeline.py [OPTIONS]
+Options:
+--tempos=T,T,...      tempos to sweep (default: 0.1,0.25,0.5,0.75,1,1.5,2,4)
+--pitches=S,S,...     pitches in semitones to sweep (default: -24,-12,0,12,24)
+--duration=SECONDS    length of the generated input (default: 30)
+--file=FILE           decode FILE instead of generating a tone
+--rate=HZ             sample rate of the generated input (default: 44100)
+--channels=N          channels of the generated input (default: 2)
+--streams=N           run N identical pipelines at the same time (default: 1)
+--output=FILE         write the JSON results to FILE instead of stdout
+--compare=FILE        print the change against the results in FILE
+"""
+
+import getopt
+import os
+import resource
+import sys
+import time
+
+from common import compare, log, write_results
+
+from playitslowly.pipeline import Gst
+
+TEMPOS = [0.1, 0.25, 0.5, 0.75, 1.0, 1.5, 2.0, 4.0]
+PITCHES = [-24, -12, 0, 12, 24]
+SAMPLES_PER_BUFFER = 1024
+
+
+def cpu_time():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def build(source, tempo, semitones):
+    return Gst.parse_launch("%s ! audioconvert ! pitch tempo=%f pitch=%f ! audioconvert ! "
+            "fakesink sync=false" % (source, tempo, 2**(semitones/12.0)))
+
+
+def tone_source(duration, rate, channels):
+    return ("audiotestsrc wave=sine num-buffers=%d samplesperbuffer=%d ! "
+            "audio/x-raw,format=S16LE,rate=%d,channels=%d" % (
+                round(duration * rate / SAMPLES_PER_BUFFER), SAMPLES_PER_BUFFER, rate, channels))
+
+
+def file_duration(source):
+    """return the length of the decoded source in seconds"""
+    pipeline = Gst.parse_launch("%s ! fakesink" % source)
+    pipeline.set_state(Gst.State.PAUSED)
+    pipeline.get_state(Gst.CLOCK_TIME_NONE)
+    ok, duration = pipeline.query_duration(Gst.Format.TIME)
+    pipeline.set_state(Gst.State.NULL)
+    return duration / Gst.SECOND if ok else 0.0
+
+
+def run_pipelines(pipelines):
+    """play all pipelines to their end, return (wall seconds, cpu seconds)"""
+    cpu_started = cpu_time()
+    started = time.perf_counter()
+    for pipeline in pipelines:
+        pipeline.set_state(Gst.State.PLAYING)
+    try:
+        for pipeline in pipelines:
+            message = pipeline.get_bus().timed_pop_filtered(Gst.CLOCK_TIME_NONE,
+                    Gst.MessageType.EOS | Gst.MessageType.ERROR)
+            if message.type == Gst.MessageType.ERROR:
+                raise RuntimeError("%s - %s" % message.parse_error())
+        return time.perf_counter() - started, cpu_time() - cpu_started
+    finally:
+        for pipeline in pipelines:
+            pipeline.set_state(Gst.State.NULL)
+
+
+def run(source, duration, tempos, pitches, streams, input_name="tone"):
+    results = []
+    for tempo in tempos:
+        for semitones in pitches:
+            params = {"input": input_name, "tempo": tempo, "pitch": semitones,
+                      "duration": duration, "streams": streams}
+            log("tempo %g, pitch %+g" % (tempo, semitones))
+            wall, cpu = run_pipelines([build(source, tempo, semitones) for i in range(streams)])
+            output = duration / tempo * streams
+            results.append({
+                "name": "pitch", "params": params,
+                "seconds": {"min": wall, "median": wall, "runs": 1},
+                "cpu_seconds": cpu,
+                "cpu_percent": cpu / wall * 100 if wall > 0 else 0.0,
+                "realtime_factor": output / wall if wall > 0 else 0.0,
+                "streams": output / cpu if cpu > 0 else 0.0,
+            })
+    return results
+
+
+def main(args):
+    tempos, pitches = TEMPOS, PITCHES
+    duration = 30.0
+    filename = None
+    rate, channels, streams = 44100, 2, 1
+    output = previous = None
+    try:
+        options, arguments = getopt.getopt(args, "h", ["help", "tempos=", "pitches=",
+            "duration=", "file=", "rate=", "channels=", "streams=", "output=", "compare="])
+        for option, argument in options:
+            if option in ("-h", "--help"):
+                print(__doc__)
+                return 0
+            elif option == "--tempos":
+                tempos = [float(t) for t in argument.split(",")]
+            elif option == "--pitches":
+                pitches = [float(p) for p in argument.split(",")]
+            elif option == "--duration":
+                duration = float(argument)
+            elif option == "--file":
+                filename = argument
+            elif option == "--rate":
+                rate = int(argument)
+            elif option == "--channels":
+                channels = int(argument)
+            elif option == "--streams":
+                streams = max(1, int(argument))
+            elif option == "--output":
+                output = argument
+            elif option == "--compare":
+                previous = argument
+    except (getopt.GetoptError, ValueError) as e:
+        print(e, file=sys.stderr)
+        print(__doc__, file=sys.stderr)
+        return 2
+
+    Gst.init(None)
+    if Gst.ElementFactory.find("pitch") is None:
+        print("The soundtouch pitch element (gstreamer-plugins-bad) is not installed",
+                file=sys.stderr)
+        return 1
+
+    if filename:
+        source = "uridecodebin uri=%s ! audioconvert ! audioresample" % (
+            Gst.filename_to_uri(os.path.abspath(filename)))
+        duration = file_duration(source)
+        if duration <= 0:
+            print("Could not determine the length of %s" % filename, file=sys.stderr)
+            return 1
+    else:
+        # audiotestsrc only produces whole buffers
+        duration = int(duration * rate / SAMPLES_PER_BUFFER) * SAMPLES_PER_BUFFER / rate
+        source = tone_source(duration, rate, channels)
+
+    results = run(source, duration, tempos, pitches, streams,
+            os.path.basename(filename) if filename else "tone")
+    write_results("pipeline", results, output)
+    if previous:
+        compare(previous, results)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+Benchmarks of the waveform extraction and rendering of Play it Slowly.
+
+Synthetic PCM fixtures (a tone with some noise and a slowly changing
+volume) of every combination of the given durations, channel counts and
+sample rates are fed block by block into a WaveformExtractor, the same way
+the decoder does, as interleaved PCM with all channels. For every fixture
+this measures:
+
+- extract: feeding all blocks, finishing and building the pyramid, with
+  the peak memory allocated meanwhile
+- get_samples: the legacy interleaved envelope at several resolutions
+- render: an offscreen render of the waveform layer (as drawn by the main
+  window) at several widths and zoom levels
+
+Usage: python3 benchmarks/bench_waveform.py [OPTIONS]
+Options:
+--quick               only 1 and 10 minute fixtures, a single run each
+--durations=S,S,...   fixture lengths in seconds (default: 60,600,3600,10800)
+--channels=N,N        channel counts of the fixtures (default: 1,2)
+--rates=R,R           sample rates of the fixtures (default: 44100,96000)
+--repeat=N            runs per measurement, the minimum is reported (default: 3)
+--output=FILE         write the JSON results to FILE instead of stdout
+--compare=FILE        print the change against the results in FILE
+"""
+
+import getopt
+import sys
+
+import numpy as np
+
+from common import compare, log, measure, peak_memory, write_results
+
+from playitslowly.waveform import BLOCK_SIZE, WaveformExtractor
+
+DURATIONS = [60, 600, 3600, 3 * 3600]
+CHANNELS = [1, 2]
+RATES = [44100, 96000]
+RESOLUTIONS = [2000, 20000, 200000]
+WIDTHS = [800, 1920, 3840]
+# fraction of the track visible in the view
+ZOOMS = [1.0, 0.1, 0.01, 0.001]
+HEIGHT = 100
+# number of different blocks the fixtures cycle through
+PATTERN_BLOCKS = 8
+
+
+def fixture_blocks(channels, rate):
+    """
+    return PATTERN_BLOCKS blocks of BLOCK_SIZE bytes of interleaved s16 PCM of
+    a synthetic signal with the given channel count and sample rate
+    """
+    frames = BLOCK_SIZE // 2 // channels
+    t = np.arange(frames) / rate
+    rng = np.random.default_rng(0)
+    signal = np.empty((frames, channels))
+    for channel in range(channels):
+        signal[:, channel] = (0.6 * np.sin(2 * np.pi * (220 * (channel + 1)) * t)
+                + 0.05 * rng.standard_normal(frames))
+    blocks = []
+    for i in range(PATTERN_BLOCKS):
+        volume = 0.2 + 0.8 * abs(np.sin(i * 0.7 + t * 0.5))
+        blocks.append((signal * volume[:, None] * 32767).astype("<i2").tobytes())
+    return blocks
+
+
+def extract(blocks, duration, rate, channels):
+    """feed duration seconds of blocks into a new extractor"""
+    extractor = WaveformExtractor.for_stream(rate, duration, channels=channels)
+    remaining = int(duration * rate) * 2 * channels
+    i = 0
+    while remaining > 0:
+        block = blocks[i % len(blocks)]
+        if remaining < len(block):
+            block = block[:remaining]
+        extractor.feed(block)
+        remaining -= len(block)
+        i += 1
+    extractor.finish()
+    extractor.pyramid()
+    return extractor
+
+
+def render(renderer_class, waveform, width, zoom):
+    start = (1.0 - zoom) / 2
+    end = start + zoom
+    renderer = renderer_class()
+    return renderer.render_layer(waveform, 1.0, start, end, width, HEIGHT, 1.0, 1,
+            (start + zoom / 4, end - zoom / 4))
+
+
+def run(durations, channel_counts, rates, repeat):
+    try:
+        from playitslowly.render import WaveformRenderer
+    except ImportError as e:
+        log("skipping the render benchmarks: %s" % e)
+        WaveformRenderer = None
+
+    results = []
+    for rate in rates:
+        for channels in channel_counts:
+            blocks = fixture_blocks(channels, rate)
+            for duration in durations:
+                params = {"duration": duration, "channels": channels, "rate": rate}
+                log("%(duration)d s, %(channels)d channels, %(rate)d Hz" % params)
+
+                seconds = measure(lambda: extract(blocks, duration, rate, channels), repeat)
+                results.append({
+                    "name": "extract", "params": params, "seconds": seconds,
+                    "peak_memory": peak_memory(extract, blocks, duration, rate, channels),
+                    "frames_per_second": duration * rate / seconds["min"],
+                })
+
+                extractor = extract(blocks, duration, rate, channels)
+                for points in RESOLUTIONS:
+                    results.append({
+                        "name": "get_samples", "params": dict(params, points=points),
+                        "seconds": measure(lambda: extractor.get_samples(points), repeat),
+                        "peak_memory": peak_memory(extractor.get_samples, points),
+                    })
+
+                if WaveformRenderer is None:
+                    continue
+                waveform = extractor.snapshot()
+                for width in WIDTHS:
+                    for zoom in ZOOMS:
+                        results.append({
+                            "name": "render",
+                            "params": dict(params, width=width, zoom=zoom),
+                            "seconds": measure(lambda: render(WaveformRenderer, waveform,
+                                width, zoom), repeat),
+                            "peak_memory": peak_memory(render, WaveformRenderer, waveform,
+                                width, zoom),
+                        })
+    return results
+
+
+def main(args):
+    durations, channel_counts, rates = DURATIONS, CHANNELS, RATES
+    repeat = 3
+    output = previous = None
+    try:
+        options, arguments = getopt.getopt(args, "h", ["help", "quick", "durations=",
+            "channels=", "rates=", "repeat=", "output=", "compare="])
+        for option, argument in options:
+            if option in ("-h", "--help"):
+                print(__doc__)
+                return 0
+            elif option == "--quick":
+                durations = [60, 600]
+                repeat = 1
+            elif option == "--durations":
+                durations = [int(d) for d in argument.split(",")]
+            elif option == "--channels":
+                channel_counts = [int(c) for c in argument.split(",")]
+            elif option == "--rates":
+                rates = [int(r) for r in argument.split(",")]
+            elif option == "--repeat":
+                repeat = max(1, int(argument))
+            elif option == "--output":
+                output = argument
+            elif option == "--compare":
+                previous = argument
+    except (getopt.GetoptError, ValueError) as e:
+        print(e, file=sys.stderr)
+        print(__doc__, file=sys.stderr)
+        return 2
+
+    results = run(durations, channel_counts, rates, repeat)
+    write_results("waveform", results, output)
+    if previous:
+        compare(previous, results)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,103 @@
+"""
+Helpers shared by the Play it Slowly benchmarks.
+
+Every benchmark produces a list of results, each a dict with the "name" of
+the measured operation, its "params" and the measured values. write_results
+stores them together with a description of the machine and the git revision
+as JSON, compare prints how the timings changed relative to such a file.
+"""
+
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    # run from a checkout, benchmark the code next to it
+    sys.path.insert(0, ROOT)
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                stderr=subprocess.DEVNULL).decode("ascii").strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment():
+    return {
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+def measure(function, repeat=5, setup=None):
+    """
+    call function repeat times and return the min and median wall time in
+    seconds. If given, setup is called before every run (untimed) and its
+    return value passed to function.
+    """
+    times = []
+    for i in range(repeat):
+        args = (setup(),) if setup else ()
+        started = time.perf_counter()
+        function(*args)
+        times.append(time.perf_counter() - started)
+    return {"min": min(times), "median": statistics.median(times), "runs": repeat}
+
+
+def peak_memory(function, *args):
+    """return the peak number of bytes allocated while function(*args) ran"""
+    tracemalloc.start()
+    try:
+        function(*args)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def result_key(result):
+    return (result["name"], json.dumps(result["params"], sort_keys=True))
+
+
+def write_results(benchmark, results, path=None):
+    """write the results as JSON to path, or to stdout without a path"""
+    data = {"benchmark": benchmark, "environment": environment(), "results": results}
+    if path:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2)
+    else:
+        json.dump(data, sys.stdout, indent=2)
+        print()
+
+
+def compare(path, results, field="seconds", out=sys.stderr):
+    """print how the min times of results changed against the results in path"""
+    with open(path, encoding="utf-8") as f:
+        old = json.load(f)
+    previous = {result_key(r): r for r in old["results"]}
+    print("compared to %s (revision %s):" % (path, old["environment"].get("revision")), file=out)
+    for result in results:
+        before = previous.get(result_key(result))
+        if before is None or field not in before or field not in result:
+            continue
+        ratio = result[field]["min"] / before[field]["min"] if before[field]["min"] else 0.0
+        print("  %-14s %-60s %8.4f s -> %8.4f s  %+6.1f%%" % (
+            result["name"], json.dumps(result["params"], sort_keys=True),
+            before[field]["min"], result[field]["min"], (ratio - 1) * 100), file=out)
+
+
+def log(message):
+    """progress goes to stderr, stdout may carry the JSON"""
+    print(message, file=sys.stderr)
+    sys.stderr.flush()
@@ -22,10 +22,24 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
+import contextlib
 import getopt
 import mimetypes
 import os
 import sys
+import tempfile
+import threading
+import time
+
+# startup is measured from here on, see --profile-startup
+STARTED = time.perf_counter()
+
+if __name__ == "__main__" and "--export" in sys.argv[1:]:
+    # headless, dispatched before Gtk is imported and myGtk installs its
+    # exception dialog, errors are printed instead
+    from playitslowly import export, trace
+    trace.handle_options(sys.argv)
+    sys.exit(export.main(sys.argv[1:]))
 
 try:
     import json
@@ -35,11 +49,9 @@ except ImportError:
 import gi
 gi.require_version('Gst', '1.0')
 
-from gi.repository import Gtk, GObject, Gst, Gio, Gdk
-
-Gst.init(None)
-
-from playitslowly.pipeline import Pipeline
+# GStreamer and the pipeline module are only imported once a file is opened,
+# see init_gstreamer
+from gi.repository import Gtk, GObject, Gio, Gdk, GLib
 
 import logging
 logging.basicConfig(level=logging.INFO, format='[%(levelname)s] %(message)s')
@@ -47,6 +59,7 @@ logging.basicConfig(level=logging.INFO, format='[%(levelname)s] %(message)s')
 # always enable button images
 
 from playitslowly import myGtk
+from playitslowly import trace
 myGtk.install()
 
 
@@ -58,23 +71,88 @@ WEBSITE = "http://29a.ch/playitslowly/"
 
 if sys.platform == "win32":
     CONFIG_PATH = os.path.expanduser("~/playitslowly.json")
+    SETTINGS_PATH = os.path.expanduser("~/playitslowly.sqlite")
 else:
     XDG_CONFIG_HOME = os.path.expanduser(os.environ.get("XDG_CONFIG_HOME", "~/.config"))
     if not os.path.exists(XDG_CONFIG_HOME):
         os.mkdir(XDG_CONFIG_HOME)
     CONFIG_PATH = os.path.join(XDG_CONFIG_HOME, "playitslowly.json")
+    SETTINGS_PATH = os.path.join(XDG_CONFIG_HOME, "playitslowly.sqlite")
+
+# how often (in seconds) partially decoded envelopes are handed to the
+# main loop while a file is loading
+WAVEFORM_PROGRESS_INTERVAL = 0.25
+# loop boundaries and durations closer than this (in seconds) are the same,
+# so rounding noise does not restart the loop with a flushing seek
+TIME_TOLERANCE = 0.001
+
+
+def same_time(a, b):
+    return abs(a - b) <= TIME_TOLERANCE
 
-TIME_FORMAT = Gst.Format(Gst.Format.TIME)
+
+def same_loop(a, b):
+    """compare two (start, end) loops or None with TIME_TOLERANCE"""
+    if a is None or b is None:
+        return a is b
+    return same_time(a[0], b[0]) and same_time(a[1], b[1])
+
+class StartupProfile:
+    """collects how long each phase of the startup took, see --profile-startup"""
+    def __init__(self):
+        self.enabled = False
+        self.phases = []
+        self.reported = False
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((name, time.perf_counter() - started))
+
+    def mark(self, name):
+        """record name as a phase that ended now and started with the process"""
+        self.phases.append((name, time.perf_counter() - STARTED))
+
+    def report(self, out=sys.stderr):
+        """print the phases once, if enabled"""
+        if not self.enabled or self.reported:
+            return False
+        self.reported = True
+        print("Startup profile (ms):", file=out)
+        for name, duration in self.phases:
+            print("  %-24s %8.1f" % (name, duration*1000), file=out)
+        print("  %-24s %8.1f" % ("total", (time.perf_counter() - STARTED)*1000), file=out)
+        return False
+
+startup = StartupProfile()
+
+def init_gstreamer():
+    """import and initialise GStreamer, it is not needed to show the window"""
+    # imported through the pipeline module, it keeps Gst away from sys.argv
+    from playitslowly import pipeline
+    if pipeline.Gst.is_initialized():
+        return pipeline.Gst
+    with startup.phase("Gst.init"):
+        return pipeline.init_gstreamer()
 
 def in_pathlist(filename, paths = os.environ.get("PATH").split(os.pathsep)):
     """check if an application is somewhere in $PATH"""
     return any(os.path.exists(os.path.join(path, filename)) for path in paths)
 
 class Config(dict):
-    """Very simple json config file"""
+    """
+    Very simple json config file. It is written atomically by a background
+    thread, so saving never blocks the user interface.
+    """
     def __init__(self, path=None):
         dict.__init__(self)
         self.path = path
+        self._lock = threading.Condition()
+        self._pending = None    # the latest snapshot that is not written yet
+        self._writer = None
 
     def load(self):
         with open(self.path, encoding="utf-8") as f:
@@ -87,8 +165,50 @@ class Config(dict):
         self.update(data)
 
     def save(self):
-        with open(self.path, mode="w", encoding="utf-8") as f:
-            json.dump(self, f)
+        """write the config in the background, only the latest snapshot is written"""
+        # the nested dicts are copied too, the writer must not see them change
+        snapshot = {key: dict(value) if isinstance(value, dict) else value
+                for key, value in self.items()}
+        with self._lock:
+            self._pending = snapshot
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write_pending,
+                        name="config writer", daemon=True)
+                self._writer.start()
+
+    def flush(self):
+        """wait until everything saved so far is written"""
+        with self._lock:
+            while self._writer is not None:
+                self._lock.wait()
+
+    def _write_pending(self):
+        while True:
+            with self._lock:
+                snapshot, self._pending = self._pending, None
+                if snapshot is None:
+                    self._writer = None
+                    self._lock.notify_all()
+                    return
+            try:
+                self._write(snapshot)
+            except (IOError, OSError, TypeError, ValueError) as e:
+                logging.error(f"Could not save the config: {e}")
+
+    @trace.traced("config write")
+    def _write(self, data):
+        """replace the config file with data, readers see either the old or the new file"""
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.path) or ".",
+                prefix=".playitslowly-", suffix=".tmp")
+        try:
+            with os.fdopen(fd, mode="w", encoding="utf-8") as f:
+                json.dump(data, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
 
 
 class MainWindow(Gtk.Window):
@@ -109,15 +229,25 @@ class MainWindow(Gtk.Window):
         self.accel_group = Gtk.AccelGroup()
         self.add_accel_group(self.accel_group)
 
-
-        self.pipeline = Pipeline(sink)
+        # the pipelines are built when they are needed first, see pipeline
+        self.sink = sink
+        self._pipeline = None
+        self._loop_player = None
+        self._variants = None
+        self._export_queue = None
 
         # --- Waveform Drawing Area ---
         self.waveform_area = Gtk.DrawingArea()
         self.waveform_area.set_size_request(600, 100)
         self.waveform_area.connect("draw", self.on_waveform_draw)
-        self.waveform_samples = None
+        self.waveform = None             # WaveformExtractor snapshot, owned by the main loop
         self.waveform_loaded = False
+        self.waveform_fraction = 1.0     # fraction of the track covered by waveform
+        self.waveform_generation = 0     # bumped for every file, stale workers stop
+        self.peak_cache = None
+        self.waveform_renderer = None
+        self.playhead_tick = None        # frame clock callback id while playing
+        self.playhead_x = None           # x position of the last drawn playback line
         self.waveform_view_start = 0.0   # fraction of total waveform (0.0–1.0)
         self.waveform_view_end = 1.0     # fraction of total waveform (0.0–1.0)
         self.vbox.pack_start(self.waveform_area, False, False, 4)
@@ -150,6 +280,18 @@ class MainWindow(Gtk.Window):
         self.waveform_height_scale.connect("value-changed", lambda w: self.waveform_area.queue_draw())
         self.vbox.pack_start(self.waveform_height_scale, False, False, 2)
 
+        # --- Waveform display modes, they only change how the envelope is drawn ---
+        waveform_modes = Gtk.HBox()
+        self.split_channels_button = Gtk.CheckButton(label=_("Split channels"))
+        self.split_channels_button.set_tooltip_text(_("Draw every channel of the track separately"))
+        self.split_channels_button.connect("toggled", self.waveformmodechanged)
+        waveform_modes.pack_start(self.split_channels_button, False, False, 0)
+        self.show_rms_button = Gtk.CheckButton(label=_("Show RMS"))
+        self.show_rms_button.set_tooltip_text(_("Draw the average loudness over the peaks"))
+        self.show_rms_button.connect("toggled", self.waveformmodechanged)
+        waveform_modes.pack_start(self.show_rms_button, False, False, 0)
+        self.vbox.pack_start(waveform_modes, False, False, 2)
+
         self.dragging_marker = None  # "start", "end" or None
 
         # --- File chooser, speed/pitch/position controls ---        # Connect signals for zooming when start/end sliders move
@@ -229,6 +371,12 @@ class MainWindow(Gtk.Window):
         self.volume_button.connect("value-changed", self.volumechanged)
         buttonbox.pack_start(self.volume_button, True, True, 0)
 
+        self.prerender_button = Gtk.CheckButton(label=_("Pre-render loop"))
+        self.prerender_button.set_tooltip_text(_("Render the loop at the practice speeds "
+            "in the background and switch between them instantly"))
+        self.prerender_button.connect("toggled", self.prerenderchanged)
+        buttonbox.pack_start(self.prerender_button, True, True, 0)
+
         self.save_as_button = Gtk.Button.new_with_mnemonic('Save As')
         self.save_as_button.connect("clicked", self.save)
         self.save_as_button.set_sensitive(False)
@@ -243,24 +391,83 @@ class MainWindow(Gtk.Window):
         self.add(self.vbox)
         self.connect("destroy", Gtk.main_quit)
 
+        # --- Export progress, hidden while nothing is exported ---
+        self.export_box = Gtk.HBox()
+        self.export_progress = Gtk.ProgressBar()
+        self.export_progress.set_show_text(True)
+        self.export_box.pack_start(self.export_progress, True, True, 4)
+        export_cancel = Gtk.Button(label=_("Cancel"))
+        export_cancel.connect("clicked", lambda sender: self.export_queue.cancel())
+        self.export_box.pack_start(export_cancel, False, False, 0)
+        self.export_box.show_all()
+        self.export_box.set_no_show_all(True)
+        self.export_box.hide()
+        self.vbox.pack_end(self.export_box, False, False, 4)
+        self.connect("destroy", self.on_destroy)
+
+        from playitslowly.settingsstore import SettingsStore, DEFAULT_MAX_ENTRIES
+        self.file_settings = SettingsStore(SETTINGS_PATH,
+                int(config.get("max_files", DEFAULT_MAX_ENTRIES)))
+        if "files" in config:
+            # older versions kept the settings of every file in the config
+            self.file_settings.migrate(config.pop("files"))
+            config.save()
+
         self.config = config
         self.config_saving = False
         self.load_config()
 
-        # --- Periodic waveform refresh (for moving playback line) ---
-        from gi.repository import GLib
-
-        def refresh_waveform():
-            # Always repaint if window is visible
-            try:
-                if self.waveform_loaded and self.waveform_area.get_mapped():
-                    self.waveform_area.queue_draw()
-            except Exception as e:
-                logging.debug(f"refresh_waveform error: {e}")
-            return True
-
-        # Start after GTK mainloop is fully running (50ms delay)
-        GLib.timeout_add(50, lambda: GLib.timeout_add(16, refresh_waveform))
+    @property
+    def pipeline(self):
+        """the playback pipeline, built when it is needed first"""
+        if self._pipeline is None:
+            init_gstreamer()
+            with startup.phase("pipeline"):
+                from playitslowly.pipeline import Pipeline
+                self._pipeline = Pipeline(self.sink)
+        return self._pipeline
+
+    @property
+    def loop_player(self):
+        if self._loop_player is None:
+            init_gstreamer()
+            from playitslowly.variants import LoopPlayer
+            self._loop_player = LoopPlayer(self.sink)
+        return self._loop_player
+
+    @property
+    def variants(self):
+        """the cache of pre-rendered variants of the loop"""
+        if self._variants is None:
+            init_gstreamer()
+            from playitslowly.variants import VariantCache
+            self._variants = VariantCache(int(self.config.get("prerender_cache_size", 128)) << 20)
+            self._variants.rendered = lambda key: self.update_practice()
+        return self._variants
+
+    @property
+    def export_queue(self):
+        if self._export_queue is None:
+            init_gstreamer()
+            from playitslowly.export import ExportQueue
+            self._export_queue = ExportQueue()
+            self._export_queue.changed = self.exports_changed
+            self._export_queue.finished = self.export_finished
+        return self._export_queue
+
+    @property
+    def practicing(self):
+        """True while the loop is played from a pre-rendered variant"""
+        return self._loop_player is not None and self._loop_player.playing
+
+    def on_destroy(self, sender):
+        # do not leave exports and renderings behind when the window is closed
+        if self._export_queue is not None:
+            self._export_queue.cancel()
+        if self._variants is not None:
+            self._variants.cancel()
+        if self._loop_player is not None:
+            self._loop_player.stop()
 
     # ------------------------------------------------------------
     # Waveform mouse interaction
@@ -317,6 +524,8 @@ class MainWindow(Gtk.Window):
         return True
 
     def on_waveform_release(self, widget, event):
+        if self.dragging_marker:
+            self.update_loop()
         self.dragging_marker = None
         return True
 
@@ -378,132 +587,112 @@ class MainWindow(Gtk.Window):
 
         self.waveform_area.queue_draw()
 
+    @trace.traced("draw")
     def on_waveform_draw(self, widget, cr):
         import cairo
-        if not self.waveform_loaded or self.waveform_samples is None:
+        if not self.waveform_loaded or self.waveform is None:
             return False
 
         alloc = widget.get_allocation()
         width, height = alloc.width, alloc.height
-        samples = self.waveform_samples
-        if len(samples) == 0:
-            return False
-
-        max_val = max(abs(samples.max()), abs(samples.min()))
-        if max_val == 0:
-            return False
+        vertical_zoom = self.waveform_height_scale.get_value() if hasattr(self, "waveform_height_scale") else 1.0
 
         import numpy as np
-        norm_samples = samples / max_val
 
-        # --- Compute zoomed region indices ---
-        total_len = len(norm_samples)
-        view_start_idx = int(self.waveform_view_start * total_len)
-        view_end_idx = int(self.waveform_view_end * total_len)
-        view_end_idx = min(view_end_idx, total_len - 1)
+        # Map absolute fractions to local visible window
+        def frac_to_x(f):
+            return (f - self.waveform_view_start) / (self.waveform_view_end - self.waveform_view_start) * width
 
-        # --- Slice zoom region ---
-        visible = norm_samples[view_start_idx:view_end_idx]
-        if len(visible) < 2:
+        total = self.endchooser.get_adjustment().get_upper()
+        selection = None
+        if total > 0:
+            selection = (self.startchooser.get_value() / total, self.endchooser.get_value() / total)
+
+        # --- Static layer: waveform, selection and markers ---
+        # only rendered again when the view or the selection changes
+        layer = self.waveform_renderer.render_layer(self.waveform, self.waveform_fraction,
+                self.waveform_view_start, self.waveform_view_end, width, height,
+                vertical_zoom, widget.get_scale_factor(), selection,
+                self.split_channels_button.get_active(), self.show_rms_button.get_active())
+        if layer is None:
             return False
 
-        # --- Resample to match widget width ---
-        # This keeps the zoomed region filling the entire view width
-        x = np.linspace(0, len(visible) - 1, width)
-        points = np.interp(x, np.arange(len(visible)), visible)
-
-        mid = height // 2
-        vertical_zoom = self.waveform_height_scale.get_value() if hasattr(self, "waveform_height_scale") else 1.0
-
-        # Apply vertical zoom (clamp so it doesn't overflow)
-        amp = int((height // 2 - 2) * vertical_zoom)
-
-        # Fill background to make waveform visible
         cr.set_antialias(cairo.ANTIALIAS_NONE)
-        cr.set_source_rgb(0.1, 0.1, 0.1)
-        cr.rectangle(0, 0, width, height)
-        cr.fill()
-
-        # Draw waveform
-        cr.set_source_rgb(0.2, 0.6, 1.0)
-        cr.set_line_width(1)
-        cr.move_to(0, mid)
-        for x, y in enumerate(points):
-            cr.line_to(x, mid - int(y * amp))
-        cr.stroke()
-
-        # --- Draw selection area ---
-        total = self.endchooser.get_adjustment().get_upper()
-        if total > 0:
-            start_frac = self.startchooser.get_value() / total
-            end_frac = self.endchooser.get_value() / total
+        cr.set_source_surface(layer, 0, 0)
+        cr.paint()
 
-            # Map absolute fractions to local visible window
-            def frac_to_x(f):
-                return (f - self.waveform_view_start) / (self.waveform_view_end - self.waveform_view_start) * width
+        if selection is None:
+            return False
 
-            x1 = frac_to_x(start_frac)
-            x2 = frac_to_x(end_frac)
+        # --- Overlay: played region and playback line ---
+        x_pos = frac_to_x(self.get_playhead_fraction())
+        self.playhead_x = x_pos
 
-            # --- Selection (loop region) overlay ---
-            cr.set_source_rgba(0.9, 0.3, 0.4, 0.25)  # translucent pink/red
-            cr.rectangle(min(x1, x2), 0, abs(x2 - x1), height)
+        # draw blue overlay for played region
+        if x_pos > 0:
+            cr.set_source_rgba(0.3, 0.6, 1.0, 0.25)
+            cr.rectangle(0, 0, min(x_pos, width), height)
             cr.fill()
 
-            try:
-                # Robust position/duration query from GStreamer
-                ok_pos, pos_ns = self.pipeline.playbin.query_position(Gst.Format.TIME)
-                ok_dur, dur_ns = self.pipeline.playbin.query_duration(Gst.Format.TIME)
-
-                if not ok_pos:
-                    pos_ns = 0
-                if not ok_dur or dur_ns == 0:
-                    # fall back to endchooser upper bound if duration not known yet
-                    dur_ns = int(self.endchooser.get_adjustment().get_upper() * Gst.SECOND)
-
-                # Convert to seconds
-                pos_time = pos_ns / Gst.SECOND
-                dur_time = dur_ns / Gst.SECOND
-                total_time = max(dur_time, 0.001)
-
-                pos_frac = min(1.0, max(0.0, pos_time / total_time))
-                logging.debug(f"Playback line: {pos_time:.2f}s / {total_time:.2f}s -> {pos_frac:.2%}")
-            except Exception as e:
-                logging.debug(f"Waveform position query failed: {e}")
-                pos_frac = 0.0
-
-            x_pos = frac_to_x(pos_frac)
-
-            # draw blue overlay for played region
-            if x_pos > 0:
-                cr.set_source_rgba(0.3, 0.6, 1.0, 0.25)
-                cr.rectangle(0, 0, min(x_pos, width), height)
-                cr.fill()
-
-                # --- Moving playback line ---
-                cr.set_source_rgb(1.0, 1.0, 1.0)  # white line
-                cr.set_line_width(1.0)
-                if 0 <= x_pos <= width:
-                    cr.move_to(x_pos, 0)
-                    cr.line_to(x_pos, height)
-                    cr.stroke()
-
-                # optional small circle marker at mid height
-                cr.arc(x_pos, mid, 2.0, 0, 2 * np.pi)
-                cr.fill()
-
-            # --- Start/End marker lines (contrasting color) ---
-            cr.set_source_rgb(1.0, 0.6, 0.0)  # bright orange markers
-            cr.set_line_width(1.2)
-            for xline in (x1, x2):
-                if 0 <= xline <= width:
-                    cr.move_to(xline, 0)
-                    cr.line_to(xline, height)
-            cr.stroke()
+            # --- Moving playback line ---
+            cr.set_source_rgb(1.0, 1.0, 1.0)  # white line
+            cr.set_line_width(1.0)
+            if 0 <= x_pos <= width:
+                cr.move_to(x_pos, 0)
+                cr.line_to(x_pos, height)
+                cr.stroke()
+
+            # optional small circle marker at mid height
+            cr.arc(x_pos, height // 2, 2.0, 0, 2 * np.pi)
+            cr.fill()
 
         return False
 
 
+    def get_playhead_fraction(self):
+        """return the playback position as a fraction of the track"""
+        # both come from the position clock of the pipeline, no queries per frame
+        position = self.get_position() or 0.0
+        duration = self.pipeline.get_duration()
+        if not duration:
+            # fall back to endchooser upper bound if duration not known yet
+            duration = self.endchooser.get_adjustment().get_upper()
+        return min(1.0, max(0.0, position / max(duration, 0.001)))
+
+    def queue_playhead_draw(self):
+        """invalidate only the strip between the old and the new playback line"""
+        if not self.waveform_loaded or not self.waveform_area.get_mapped():
+            return
+        width = self.waveform_area.get_allocated_width()
+        height = self.waveform_area.get_allocated_height()
+        view_width = self.waveform_view_end - self.waveform_view_start
+        x_pos = (self.get_playhead_fraction() - self.waveform_view_start) / view_width * width
+        if self.playhead_x is None:
+            self.waveform_area.queue_draw()
+            return
+        if int(x_pos) == int(self.playhead_x):
+            return
+        # the line is 1px wide and the position marker has a radius of 2px
+        x0 = max(0, int(min(x_pos, self.playhead_x)) - 3)
+        x1 = min(width, int(max(x_pos, self.playhead_x)) + 4)
+        if x1 > x0:
+            self.waveform_area.queue_draw_area(x0, 0, x1 - x0, height)
+
+    def on_playhead_tick(self, widget, frame_clock):
+        self.queue_playhead_draw()
+        return GLib.SOURCE_CONTINUE
+
+    def start_playhead_animation(self):
+        if self.playhead_tick is None:
+            self.playhead_tick = self.waveform_area.add_tick_callback(self.on_playhead_tick)
+
+    def stop_playhead_animation(self):
+        if self.playhead_tick is not None:
+            self.waveform_area.remove_tick_callback(self.playhead_tick)
+            self.playhead_tick = None
+        # draw the final position once
+        self.queue_playhead_draw()
+
     def on_selection_changed(self, sender):
         """Update waveform zoom when start or end slider moves."""
         try:
@@ -540,23 +729,70 @@ class MainWindow(Gtk.Window):
 
 
     def load_waveform(self, filename):
+        """start extracting the waveform of filename in a worker thread"""
+        self.waveform_generation += 1
+        self.waveform = None
+        self.waveform_loaded = False
+        self.waveform_fraction = 1.0
+        self.waveform_area.queue_draw()
+
         try:
             from playitslowly.waveform import WaveformExtractor
+            from playitslowly.peakcache import PeakCache
         except Exception as e:
             logging.error(f"Could not import WaveformExtractor: {e}")
-            self.waveform_loaded = False
             return
 
+        if self.peak_cache is None:
+            self.peak_cache = PeakCache()
+        if self.waveform_renderer is None:
+            from playitslowly.render import WaveformRenderer
+            self.waveform_renderer = WaveformRenderer()
+        # the worker decodes with GStreamer, it is initialised on the main thread
+        init_gstreamer()
+        worker = threading.Thread(target=self.extract_waveform,
+                args=(WaveformExtractor, filename, self.waveform_generation))
+        worker.daemon = True
+        worker.start()
+
+    def extract_waveform(self, extractor_class, filename, generation):
+        """runs in a worker thread and posts (partial) envelopes to the main loop"""
+        last_update = [time.monotonic()]
+
+        def progress(extractor):
+            if generation != self.waveform_generation:
+                return False
+            now = time.monotonic()
+            if now - last_update[0] >= WAVEFORM_PROGRESS_INTERVAL:
+                last_update[0] = now
+                GLib.idle_add(self.waveform_progress, generation,
+                        extractor.snapshot(), extractor.loaded_fraction())
+            return True
+
         try:
-            extractor = WaveformExtractor(filename)
-            self.waveform_samples = extractor.get_samples(50000)
-            self.waveform_loaded = True
+            extractor = self.peak_cache.load(filename)
+            if extractor is None:
+                extractor = extractor_class(filename, progress=progress)
+                if generation == self.waveform_generation:
+                    try:
+                        self.peak_cache.store(filename, extractor)
+                    except OSError as e:
+                        logging.warning(f"Could not cache waveform: {e}")
+            # build the pyramid here rather than on the main loop
+            extractor.pyramid()
         except Exception as e:
             logging.error(f"Waveform load error: {e}")
-            self.waveform_samples = None
-            self.waveform_loaded = False
-
-        self.waveform_area.queue_draw()
+            extractor = None
+        GLib.idle_add(self.waveform_progress, generation, extractor, 1.0)
+
+    def waveform_progress(self, generation, waveform, fraction):
+        """main loop side of extract_waveform"""
+        if generation == self.waveform_generation:
+            self.waveform = waveform
+            self.waveform_loaded = waveform is not None
+            self.waveform_fraction = max(fraction, 0.0001)
+            self.waveform_area.queue_draw()
+        return False
 
     def speedpress(self, *args):
         self.speedchangeing = True
@@ -621,11 +857,21 @@ class MainWindow(Gtk.Window):
 
     def load_config(self):
         self.config_saving = True # do not save while loading
-        lastfile = self.config.get("lastfile")
-        if lastfile:
-            self.set_uri(lastfile)
+        self.prerender_button.set_active(self.config.get("prerender", False))
+        self.split_channels_button.set_active(self.config.get("split_channels", False))
+        self.show_rms_button.set_active(self.config.get("show_rms", False))
         self.config_saving = False
 
+    def open_startup_file(self, uri=None):
+        """open uri or the file of the last session, called once the window is shown"""
+        uri = uri or self.config.get("lastfile")
+        if uri:
+            self.config_saving = True # do not save while loading
+            with startup.phase("open file"):
+                self.set_uri(uri)
+            self.config_saving = False
+        return False
+
     def reset_settings(self):
         self.speedchooser.set_value(1.0)
         self.speedchanged()
@@ -638,14 +884,14 @@ class MainWindow(Gtk.Window):
     def load_file_settings(self, filename):
         logging.debug(f"Loading file settings for: {filename}")
         self.add_recent(filename)
-        if not self.config or not filename in self.config["files"]:
+        settings = self.file_settings.get(filename)
+        if settings is None:
             self.reset_settings()
             self.pipeline.set_file(filename)
             self.pipeline.pause()
             from gi.repository import GLib
             GLib.timeout_add(100, self.update_position)
             return
-        settings = self.config["files"][filename]
         self.speedchooser.set_value(settings["speed"])
         self.set_pitch(settings["pitch"])
         self.startchooser.get_adjustment().set_property("upper", settings["duration"])
@@ -662,6 +908,7 @@ class MainWindow(Gtk.Window):
         GLib.timeout_add(1000, self.save_config_now)
         self.config_saving = True
 
+    @trace.traced("config save")
     def save_config_now(self):
         self.config_saving = False
         lastfile = self.filedialog.get_uri()
@@ -673,7 +920,8 @@ class MainWindow(Gtk.Window):
         settings["start"] = self.startchooser.get_value()
         settings["end"] = self.endchooser.get_value()
         settings["volume"] = self.volume_button.get_value()
-        self.config.setdefault("files", {})[lastfile] = settings
+        if lastfile:
+            self.file_settings.put(lastfile, settings)
 
         self.config.save()
 
@@ -688,6 +936,8 @@ class MainWindow(Gtk.Window):
 
     def volumechanged(self, sender, foo):
         self.pipeline.set_volume(sender.get_value())
+        if self.practicing:
+            self.loop_player.set_volume(sender.get_value())
         self.save_config()
 
     def save(self, sender):
@@ -696,9 +946,44 @@ class MainWindow(Gtk.Window):
         dialog.set_current_name("export.wav")
         if dialog.run() == Gtk.ResponseType.OK:
             self.pipeline.set_file(self.filedialog.get_uri())
-            self.foo = self.pipeline.save_file(dialog.get_filename())
+            # only export the selected region
+            start = self.startchooser.get_value()
+            end = self.endchooser.get_value()
+            if end >= self.endchooser.get_adjustment().get_upper():
+                end = None
+            try:
+                export = self.pipeline.save_file(dialog.get_filename(), start, end)
+            except ValueError as e:
+                myGtk.show_error(_("Could not save %s: %s") % (dialog.get_filename(), e))
+            else:
+                self.export_queue.add(export)
         dialog.destroy()
 
+    def exports_changed(self, queue):
+        """show the progress of the running export"""
+        if not queue.running:
+            self.export_box.hide()
+            return
+        export = queue.running[0]
+        fraction, speed, eta = export.get_status()
+        text = _("Saving %s: %d%%") % (os.path.basename(export.location), fraction*100)
+        if speed is not None:
+            text += _(", %.1fx realtime") % speed
+        if eta is not None:
+            text += _(", %d:%02d left") % divmod(int(eta), 60)
+        if len(queue) > 1:
+            text += _(" (%d more queued)") % (len(queue) - 1)
+        self.export_progress.set_fraction(fraction)
+        self.export_progress.set_text(text)
+        self.export_box.show()
+
+    def export_finished(self, export):
+        if export.error:
+            myGtk.show_error(_("Could not save %s: %s") % (export.location, export.error))
+        elif not export.cancelled:
+            logging.info(f"Saved {export.location}")
+
+    @trace.traced("open file")
     def filechanged(self, sender=None, response_id=Gtk.ResponseType.OK, uri=None):
         filename = None
         try:
@@ -737,6 +1022,10 @@ class MainWindow(Gtk.Window):
         self.save_as_button.set_sensitive(True)
         self.play_button.set_active(False)
 
+        if self._variants is not None:
+            self._variants.cancel()
+        if self.practicing:
+            self.loop_player.stop()
         self.pipeline.reset()
         self.seek(0)
         self.save_config()
@@ -752,6 +1041,7 @@ class MainWindow(Gtk.Window):
 
     def seeked(self, sender, foo):
         self.seeking = False
+        self.update_loop()
         self.save_config()
 
     def positionchanged(self, sender, foo):
@@ -762,28 +1052,107 @@ class MainWindow(Gtk.Window):
     def seek(self, pos=0):
         if self.positionchooser.get_value() != pos:
             self.positionchooser.set_value(pos)
-        pos = self.pipeline.pipe_time(pos)
-        self.pipeline.playbin.seek_simple(TIME_FORMAT, Gst.SeekFlags.FLUSH, pos or 0)
+        if self.practicing and not self.loop_player.seek(pos):
+            self.stop_practice()
+            self.pipeline.play()
+        self.pipeline.seek(pos)
+        self.queue_playhead_draw()
 
     def speedchanged(self, *args):
-        if self.speedchangeing:
-            return
-        pos = self.positionchooser.get_value()
+        # the pipeline follows the slider live, the config is only saved
+        # once it is released
         self.pipeline.set_speed(self.speedchooser.get_value())
-        # hack to get gstreamer to calculate the position again
-        self.seek(pos)
-        self.save_config()
+        if not self.speedchangeing:
+            self.update_practice()
+            self.save_config()
 
     def pitchchanged(self, sender):
         self.pipeline.set_pitch(2**(self.get_pitch()/12.0))
+        self.update_practice()
         self.save_config()
 
+    def waveformmodechanged(self, sender):
+        self.config["split_channels"] = self.split_channels_button.get_active()
+        self.config["show_rms"] = self.show_rms_button.get_active()
+        self.waveform_area.queue_draw()
+        self.save_config()
+
+    def prerenderchanged(self, sender):
+        self.config["prerender"] = sender.get_active()
+        if sender.get_active():
+            self.prepare_variants()
+        else:
+            if self._variants is not None:
+                self._variants.cancel()
+            self.update_practice()
+        self.save_config()
+
+    def variant_key(self):
+        """return the cache key of the loop at the current speed and pitch"""
+        from playitslowly.variants import variant_key
+        start, end = self.pipeline.loop
+        return variant_key(self.filedialog.get_uri(), start, end,
+                self.speedchooser.get_value(), self.get_pitch())
+
+    def prepare_variants(self):
+        """render the loop at the current and the configured practice speeds"""
+        if (not self.prerender_button.get_active() or self._pipeline is None
+                or not self.pipeline.loop):
+            return
+        from playitslowly.variants import DEFAULT_VARIANTS
+        uri = self.filedialog.get_uri()
+        start, end = self.pipeline.loop
+        variants = [(self.speedchooser.get_value(), self.get_pitch())]
+        variants += [tuple(v) for v in self.config.get("prerender_variants", DEFAULT_VARIANTS)]
+        try:
+            self.variants.prepare(uri, start, end, variants)
+        except ValueError as e:
+            logging.error(f"Could not pre-render the loop: {e}")
+
+    def start_practice(self):
+        """play the loop from its pre-rendered variant, return False if there is none"""
+        if not self.prerender_button.get_active() or not self.pipeline.loop:
+            return False
+        data = self.variants.get(self.variant_key())
+        if data is None:
+            return False
+        tempo = self.speedchooser.get_value()
+        if self.practicing:
+            self.loop_player.switch(data, tempo)
+        else:
+            start, end = self.pipeline.loop
+            position = self.pipeline.get_position()
+            self.pipeline.pause()
+            self.loop_player.set_volume(self.volume_button.get_value())
+            self.loop_player.play(data, tempo, start, end, position)
+        return True
+
+    def stop_practice(self):
+        """hand the position of the loop player back to the (paused) pipeline"""
+        if self.practicing:
+            position = self.loop_player.get_position()
+            self.loop_player.stop()
+            self.pipeline.seek(position)
+
+    def update_practice(self):
+        """switch between the pre-rendered and the live playback of the loop"""
+        if not self.play_button.get_active():
+            return
+        if not self.start_practice() and self.practicing:
+            self.stop_practice()
+            self.pipeline.play()
+
+    def get_position(self):
+        if self.practicing:
+            return self.loop_player.get_position()
+        return self.pipeline.get_position()
+
     def back(self, sender, amount=None):
-        position, fmt = self.pipeline.playbin.query_position(TIME_FORMAT)
+        position = self.get_position()
         if position is None:
             return
         if amount:
-            t = self.pipeline.song_time(position)-amount
+            t = position-amount
             if t < 0:
                 t = 0
         else:
@@ -793,41 +1162,43 @@ class MainWindow(Gtk.Window):
     def play(self, sender):
         if sender.get_active():
             self.pipeline.set_file(self.filedialog.get_uri())
-            self.pipeline.play()
+            self.update_loop(force=True)
+            if not self.practicing:
+                self.pipeline.play()
             GObject.timeout_add(100, self.update_position)
+            self.start_playhead_animation()
         else:
+            self.stop_practice()
             self.pipeline.pause()
+            self.stop_playhead_animation()
 
     def update_position(self):
         """update the position of the scales and pipeline"""
         if self.seeking:
             return self.play_button.get_active()
 
-        _, position = self.pipeline.playbin.query_position(TIME_FORMAT)
-        _, duration = self.pipeline.playbin.query_duration(TIME_FORMAT)
+        position = self.get_position()
+        duration = self.pipeline.get_duration()
         if position is None or duration is None:
             return self.play_button.get_active()
-        position = position
-        duration = duration
-        position = self.pipeline.song_time(position)
-        duration = self.pipeline.song_time(duration)
 
         if duration is None or duration <= 0:
             return self.play_button.get_active()
 
-        if self.positionchooser.get_adjustment().get_property("upper") != duration:
+        if not same_time(self.positionchooser.get_adjustment().get_property("upper"), duration):
             self.positionchooser.set_range(0.0, max(0.001, duration))
             self.save_config()
 
         end_adjustment = self.endchooser.get_adjustment()
-        delta = end_adjustment.get_value() - end_adjustment.get_upper()
+        if not same_time(end_adjustment.get_upper(), duration):
+            delta = end_adjustment.get_value() - end_adjustment.get_upper()
 
-        if delta <= -duration:
-            delta = 0
+            if delta <= -duration:
+                delta = 0
 
-        self.startchooser.set_range(0.0, duration)
-        self.endchooser.set_range(0.0, duration)
-        self.endchooser.set_value(duration+delta)
+            self.startchooser.set_range(0.0, duration)
+            self.endchooser.set_range(0.0, duration)
+            self.endchooser.set_value(duration+delta)
 
         self.positionchooser.set_value(position)
         self.positionchooser.queue_draw()
@@ -839,12 +1210,32 @@ class MainWindow(Gtk.Window):
             self.play_button.set_active(False)
             return False
 
-        if position >= end or position < start:
-            self.seek(start+0.01)
-            return True
+        # the pipeline loops by itself, only hand it changed boundaries
+        if not self.dragging_marker:
+            self.update_loop()
 
         return self.play_button.get_active()
 
+    def update_loop(self, force=False):
+        """make the start/end selection the loop of the pipeline"""
+        start = self.startchooser.get_value()
+        end = self.endchooser.get_value()
+        loop = (start, end) if end > start else None
+        changed = not same_loop(loop, self.pipeline.loop)
+        if not changed and not force:
+            return
+        # the variants are rendered for a single loop
+        practicing = self.practicing
+        self.stop_practice()
+        self.pipeline.set_loop(start, end)
+        position = self.pipeline.get_position()
+        self.seek(start if position is None else position)
+        if changed:
+            self.prepare_variants()
+        self.update_practice()
+        if practicing and not self.practicing:
+            self.pipeline.play()
+
     def about(self, sender):
         """show an about dialog"""
         about = Gtk.AboutDialog()
@@ -882,44 +1273,62 @@ css = b"""
 
 
 def main():
-    sink = "autoaudiosink"
-    if in_pathlist("gstreamer-properties"):
-        sink = "gconfaudiosink"
-    options, arguments = getopt.getopt(sys.argv[1:], "h", ["help", "sink="])
+    trace.handle_options(sys.argv)
+
+    startup.mark("imports")
+    sink = None
+    options, arguments = getopt.getopt(sys.argv[1:], "h", ["help", "sink=", "profile-startup"])
     for option, argument in options:
         if option in ("-h", "--help"):
             print("Usage: playitslowly [OPTIONS]... [FILE]")
             print("Options:")
-            print('--sink=sink      specify gstreamer sink for playback')
+            print('--sink=sink        specify gstreamer sink for playback')
+            print('--export           render files without opening a window, see --export --help')
+            print('--profile-startup  print how long each phase of the startup took')
+            print('--trace[=FILE]     print timing histograms at exit, and write a Chrome')
+            print('                   trace to FILE (also PLAYITSLOWLY_TRACE=1 or =FILE)')
             sys.exit()
         elif option == "--sink":
             print("sink", argument)
             sink = argument
-    config = Config(CONFIG_PATH)
-    try:
-        config.load()
-    except IOError:
-        pass
+        elif option == "--profile-startup":
+            startup.enabled = True
+    if sink is None:
+        sink = "gconfaudiosink" if in_pathlist("gstreamer-properties") else "autoaudiosink"
 
-    style_provider = Gtk.CssProvider()
+    with startup.phase("config"):
+        config = Config(CONFIG_PATH)
+        try:
+            config.load()
+        except IOError:
+            pass
+
+    with startup.phase("window"):
+        style_provider = Gtk.CssProvider()
 
-    style_provider.load_from_data(css)
+        style_provider.load_from_data(css)
 
-    Gtk.StyleContext.add_provider_for_screen(
-        Gdk.Screen.get_default(),
-        style_provider,
-        Gtk.STYLE_PROVIDER_PRIORITY_APPLICATION
-    )
+        Gtk.StyleContext.add_provider_for_screen(
+            Gdk.Screen.get_default(),
+            style_provider,
+            Gtk.STYLE_PROVIDER_PRIORITY_APPLICATION
+        )
 
-    win = MainWindow(sink, config)
+        win = MainWindow(sink, config)
+        win.show_all()
 
+    # the file is only opened once the window is on the screen
+    uri = None
     if arguments:
         uri = arguments[0]
         if not uri.startswith("file://"):
             uri = "file://" + os.path.abspath(uri)
-        win.set_uri(uri)
-    win.show_all()
+    GLib.idle_add(startup.mark, "window shown")
+    GLib.idle_add(win.open_startup_file, uri)
+    GLib.idle_add(startup.report)
     Gtk.main()
+    config.flush()
+    win.file_settings.close()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,259 @@
+"""
+Author: Jonas Wagner
+
+Play it Slowly
+Copyright (C) 2009 - 2015 Jonas Wagner
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import collections
+import getopt
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from playitslowly.pipeline import (Gst, GLib, ExportPipeline, DEFAULT_EXPORT_QUALITY,
+        available_export_formats)
+
+USAGE = """Usage: playitslowly --export [OPTIONS]... FILE...
+Render every FILE at every variant without opening the user interface.
+Options:
+--variant=TEMPO[:PITCH]  speed (times) and pitch (semitones) of a variant,
+                         may be given multiple times (default: 1.0)
+--jobs=N                 number of exports running at the same time
+                         (default: number of CPUs)
+--output-dir=DIR         directory for the exported files
+                         (default: next to each FILE)
+--format=FORMAT          wav, flac, ogg, opus or mp3 (default: wav),
+                         depending on the installed encoders
+--start=SECONDS          only export from this position of every FILE on
+--end=SECONDS            only export up to this position of every FILE
+--quality=Q              encoder quality between 0.0 and 1.0 for the lossy
+                         formats (default: %.1f)""" % DEFAULT_EXPORT_QUALITY
+
+
+class ExportError(Exception):
+    pass
+
+
+def parse_variant(text):
+    """parse TEMPO[:PITCH] into a (tempo, semitones) tuple"""
+    tempo, _, pitch = text.partition(":")
+    tempo = float(tempo)
+    if not 0.1 <= tempo <= 4.0:
+        raise ValueError("tempo must be between 0.1 and 4.0: %s" % text)
+    return tempo, float(pitch or 0.0)
+
+
+def variant_filename(source, tempo, pitch, output_dir=None, export_format="wav"):
+    """return the path of the exported file for a variant of source"""
+    directory, name = os.path.split(os.path.abspath(source))
+    name = "%s-%gx" % (os.path.splitext(name)[0], tempo)
+    if pitch:
+        name += "%+gst" % pitch
+    return os.path.join(output_dir or directory, "%s.%s" % (name, export_format))
+
+
+class ExportJob:
+    """render a single file at a single tempo/pitch"""
+    def __init__(self, source, destination, tempo=1.0, pitch=0.0,
+            quality=DEFAULT_EXPORT_QUALITY, start=None, end=None):
+        self.source = source
+        self.destination = destination
+        self.tempo = tempo
+        self.pitch = pitch
+        self.quality = quality
+        self.start = start
+        self.end = end
+        self.duration = 0.0
+        self.elapsed = 0.0
+
+    def run(self):
+        """export the file, blocks until it is written"""
+        uri = Gst.filename_to_uri(os.path.abspath(self.source))
+        try:
+            pipeline = ExportPipeline(uri, self.destination, self.tempo,
+                    2**(self.pitch/12.0), quality=self.quality,
+                    start=self.start, end=self.end)
+        except ValueError as e:
+            raise ExportError("%s: %s" % (self.source, e))
+        started = time.monotonic()
+        try:
+            pipeline.run()
+        finally:
+            pipeline.stop()
+        self.elapsed = time.monotonic() - started
+        self.duration = pipeline.duration
+        if pipeline.error:
+            raise ExportError("%s: %s" % (self.source, pipeline.error))
+        return self
+
+    def report(self):
+        speed = self.duration/self.elapsed if self.elapsed > 0 else 0.0
+        return "%s -> %s: %.1f s of audio in %.1f s (%.1fx realtime)" % (
+                self.source, self.destination, self.duration, self.elapsed, speed)
+
+
+class ExportQueue:
+    """
+    Runs ExportPipelines from the main loop, at most max_running at the same
+    time so exports do not starve the playback of CPU. changed is called with
+    the queue every interval seconds while exports are running and whenever
+    an export starts or ends, finished with every pipeline that ended.
+    """
+    def __init__(self, max_running=1, interval=0.5):
+        self.max_running = max_running
+        self.interval = interval
+        self.pending = collections.deque()
+        self.running = []
+        self.timer = None
+        self.changed = lambda queue: None
+        self.finished = lambda pipeline: None
+
+    def __len__(self):
+        return len(self.pending) + len(self.running)
+
+    def add(self, pipeline):
+        self.pending.append(pipeline)
+        self.start_next()
+
+    def start_next(self):
+        while self.pending and len(self.running) < self.max_running:
+            pipeline = self.pending.popleft()
+            pipeline.done = self.on_done
+            self.running.append(pipeline)
+            pipeline.start()
+        if self.running and self.timer is None:
+            self.timer = GLib.timeout_add(int(self.interval*1000), self.on_timer)
+        self.changed(self)
+
+    def on_done(self, pipeline):
+        if pipeline in self.running:
+            self.running.remove(pipeline)
+        self.finished(pipeline)
+        self.start_next()
+
+    def on_timer(self):
+        if not self.running:
+            self.timer = None
+            return False
+        self.changed(self)
+        return True
+
+    def cancel(self):
+        """cancel all running and pending exports"""
+        self.pending.clear()
+        for pipeline in list(self.running):
+            pipeline.cancel()
+            self.on_done(pipeline)
+
+
+def run_jobs(jobs, workers=None, out=sys.stdout):
+    """run jobs on a bounded pool of workers, return the number of failures"""
+    failures = 0
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1) as pool:
+        futures = [pool.submit(job.run) for job in jobs]
+        for future in as_completed(futures):
+            try:
+                print(future.result().report(), file=out)
+            except ExportError as e:
+                failures += 1
+                print("Export failed: %s" % e, file=out)
+    total = sum(job.duration for job in jobs)
+    elapsed = time.monotonic() - started
+    print("%d of %d exports done, %.1f s of audio in %.1f s" % (
+            len(jobs) - failures, len(jobs), total, elapsed), file=out)
+    return failures
+
+
+def main(args):
+    try:
+        options, arguments = getopt.getopt(args, "h",
+                ["help", "export", "variant=", "jobs=", "output-dir=", "format=", "quality=",
+                 "start=", "end="])
+        variants = []
+        workers = None
+        output_dir = None
+        export_format = "wav"
+        quality = DEFAULT_EXPORT_QUALITY
+        start = end = None
+        for option, argument in options:
+            if option in ("-h", "--help"):
+                print(USAGE)
+                return 0
+            elif option == "--variant":
+                variants.append(parse_variant(argument))
+            elif option == "--jobs":
+                workers = max(1, int(argument))
+            elif option == "--output-dir":
+                output_dir = argument
+            elif option == "--format":
+                export_format = argument.lower()
+            elif option == "--start":
+                start = max(0.0, float(argument))
+            elif option == "--end":
+                end = float(argument)
+            elif option == "--quality":
+                quality = min(1.0, max(0.0, float(argument)))
+    except (getopt.GetoptError, ValueError) as e:
+        print(e, file=sys.stderr)
+        print(USAGE, file=sys.stderr)
+        return 2
+    if not arguments:
+        print(USAGE, file=sys.stderr)
+        return 2
+    if end is not None and end <= (start or 0.0):
+        print("--end must be after --start", file=sys.stderr)
+        return 2
+
+    # jobs running at the same time must not write the same file
+    jobs = []
+    exported = {}
+    for source in arguments:
+        for tempo, pitch in variants or [(1.0, 0.0)]:
+            destination = variant_filename(source, tempo, pitch, output_dir, export_format)
+            variant = (os.path.abspath(source), tempo, pitch)
+            if destination in exported:
+                if exported[destination] == variant:
+                    continue
+                print("%s at %gx %+gst and %s at %gx %+gst would both be exported to %s" % (
+                    exported[destination] + variant + (destination,)), file=sys.stderr)
+                return 2
+            exported[destination] = variant
+            jobs.append(ExportJob(source, destination, tempo, pitch, quality, start, end))
+
+    Gst.init(None)
+    if Gst.ElementFactory.find("pitch") is None:
+        print("You need to install the Gstreamer soundtouch elements for "
+              "play it slowly. They are part of Gstreamer-plugins-bad.", file=sys.stderr)
+        return 1
+    if export_format not in available_export_formats():
+        print("Export format %r is not available, use one of: %s" % (
+            export_format, ", ".join(available_export_formats())), file=sys.stderr)
+        return 1
+    if output_dir and not os.path.isdir(output_dir):
+        try:
+            os.makedirs(output_dir)
+        except OSError as e:
+            print("Could not create %s: %s" % (output_dir, e), file=sys.stderr)
+            return 1
+
+    return 1 if run_jobs(jobs, workers) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,131 @@
+# playitslowly/peakcache.py
+"""
+PeakCache: persistent on-disk cache for waveform envelopes.
+
+- Entries are keyed by the path, size and modification time of the audio file,
+  so a changed file is decoded again instead of showing a stale waveform.
+- All levels of the envelope pyramid are stored one after another in a plain
+  .npy array which is memory-mapped when it is loaded, next to a small .json
+  file holding the extractor metadata and the size of every level. A cached
+  waveform is shown without building the pyramid again.
+- The total size of the cache is capped, the least recently used entries are
+  evicted first.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import sys
+import tempfile
+
+import numpy as np
+
+from playitslowly import trace
+from playitslowly.waveform import BIN_SIZE, WaveformExtractor
+
+# bump whenever the stored envelope changes meaning
+FORMAT_VERSION = 4
+DEFAULT_MAX_SIZE = 256 * 1024 * 1024
+
+
+def default_cache_dir():
+    if sys.platform == "win32":
+        base = os.environ.get("LOCALAPPDATA") or os.path.expanduser("~")
+    else:
+        base = os.path.expanduser(os.environ.get("XDG_CACHE_HOME", "~/.cache"))
+    return os.path.join(base, "playitslowly", "peaks")
+
+
+class PeakCache:
+    def __init__(self, path=None, max_size=DEFAULT_MAX_SIZE):
+        self.path = path or default_cache_dir()
+        self.max_size = max_size
+
+    def key(self, filename):
+        """identify filename by its path, size and mtime"""
+        stat = os.stat(filename)
+        identity = "%s\0%d\0%d\0%d\0%d" % (os.path.abspath(filename), stat.st_size,
+                stat.st_mtime_ns, BIN_SIZE, FORMAT_VERSION)
+        return hashlib.sha1(identity.encode("utf-8", "surrogateescape")).hexdigest()
+
+    def _paths(self, key):
+        base = os.path.join(self.path, key)
+        return base + ".npy", base + ".json"
+
+    @trace.traced("peak cache load")
+    def load(self, filename):
+        """return a WaveformExtractor for filename or None if it is not cached"""
+        try:
+            peaks_path, meta_path = self._paths(self.key(filename))
+            with open(meta_path, encoding="utf-8") as f:
+                meta = json.load(f)
+            peaks = np.load(peaks_path, mmap_mode="r")
+            sizes = meta.pop("levels")
+            if sum(sizes) != peaks.shape[1]:
+                raise ValueError("the levels do not match the stored envelope")
+            # mark the entry as recently used
+            os.utime(peaks_path)
+        except (OSError, ValueError, KeyError) as e:
+            logging.debug(f"Peak cache miss for {filename}: {e}")
+            return None
+        levels = []
+        start = 0
+        for size in sizes:
+            levels.append(tuple(peaks[:, start:start + size]))
+            start += size
+        return WaveformExtractor.from_pyramid(levels, **meta)
+
+    def store(self, filename, extractor):
+        """write the envelope pyramid of extractor to the cache"""
+        peaks_path, meta_path = self._paths(self.key(filename))
+        levels = extractor.pyramid()
+        sizes = [len(level[0]) for level in levels]
+        peaks = np.empty((3, sum(sizes), extractor.channels), dtype=np.int16)
+        start = 0
+        for level, size in zip(levels, sizes):
+            peaks[:, start:start + size] = level
+            start += size
+        meta = {
+            "sample_rate": extractor.sample_rate,
+            "duration": extractor.duration,
+            "frames": extractor.frames,
+            "bin_size": extractor.bin_size,
+            "levels": sizes,
+        }
+        os.makedirs(self.path, exist_ok=True)
+        # the metadata is written last, it marks the entry as complete
+        self._write_atomic(peaks_path, lambda f: np.save(f, peaks))
+        self._write_atomic(meta_path, lambda f: f.write(json.dumps(meta).encode("utf-8")))
+        self.evict()
+
+    def _write_atomic(self, path, write):
+        fd, tmp_path = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                write(f)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def evict(self):
+        """remove least recently used entries until the cache fits max_size"""
+        entries = []
+        total = 0
+        with os.scandir(self.path) as it:
+            for entry in it:
+                if entry.name.endswith(".npy"):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.name[:-4]))
+                    total += stat.st_size
+        entries.sort()
+        for mtime, size, key in entries:
+            if total <= self.max_size:
+                break
+            for path in self._paths(key):
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+            total -= size
@@ -18,7 +18,10 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
+import collections
+import os
 import sys
+import time
 
 argv = sys.argv
 # work around Gstreamer parsing sys.argv!
@@ -27,13 +30,42 @@ sys.argv = []
 import gi
 gi.require_version('Gst', '1.0')
 
-from gi.repository import Gst
+from gi.repository import Gst, GLib
 sys.argv = argv
 
-from playitslowly import myGtk
+from playitslowly import trace
+
+# myGtk is only imported where a dialog is shown, so the module can be used
+# by the headless export without a display
+
+
+def init_gstreamer():
+    """initialise GStreamer unless that happened already, return the Gst module"""
+    if not Gst.is_initialized():
+        Gst.init(None)
+    return Gst
 
 _ = lambda x: x
 
+# export formats by file extension: (encoder, muxer or None, function
+# configuring the encoder for a quality between 0.0 and 1.0)
+EXPORT_FORMATS = collections.OrderedDict([
+    ("wav", ("wavenc", None, None)),
+    ("flac", ("flacenc", None, None)),
+    ("ogg", ("vorbisenc", "oggmux",
+        lambda encoder, quality: encoder.set_property("quality", quality))),
+    ("opus", ("opusenc", "oggmux",
+        lambda encoder, quality: encoder.set_property("bitrate", int(32000 + quality*224000)))),
+    ("mp3", ("lamemp3enc", None,
+        # lamemp3enc's VBR quality ranges from 0 (best) to 9.999
+        lambda encoder, quality: encoder.set_property("quality", min(9.999, 10.0 - quality*10.0)))),
+])
+DEFAULT_EXPORT_QUALITY = 0.5
+
+# how often (in seconds) the position is queried from the pipeline while
+# playing, in between it is extrapolated from the wall clock
+POSITION_QUERY_INTERVAL = 0.1
+
 class Pipeline(Gst.Pipeline):
     def __init__(self, sink):
         Gst.Pipeline.__init__(self)
@@ -43,6 +75,7 @@ class Pipeline(Gst.Pipeline):
         bin = Gst.Bin()
         self.speedchanger = Gst.ElementFactory.make("pitch")
         if self.speedchanger is None:
+            from playitslowly import myGtk
             myGtk.show_error(_("You need to install the Gstreamer soundtouch elements for "
                     "play it slowly to. They are part of Gstreamer-plugins-bad. Consult the "
                     "README if you need more information.")).run()
@@ -61,23 +94,143 @@ class Pipeline(Gst.Pipeline):
         sink_pad = Gst.GhostPad.new("sink", self.speedchanger.get_static_pad("sink"))
         bin.add_pad(sink_pad)
         self.playbin.set_property("audio-sink", bin)
-        #bus = self.playbin.get_bus()
-        #bus.add_signal_watch()
-        #bus.connect("message", self.on_message)
+
+        self.playing = False
+        self.loop = None                # (start, end) in seconds, see set_loop
+        self._pending_seek = None       # seek issued before the pipeline prerolled
+        # (pipeline time, song position) at which the current tempo took effect
+        self._anchor = (0, 0.0)
+        self._duration = None           # song time in seconds, cached until it changes
+        self._position = None           # (wall clock, pipeline time) of the last query
+
+        bus = self.get_bus()
+        bus.add_signal_watch()
+        bus.connect("message", self.on_message)
 
         self.eos = lambda: None
 
     def on_message(self, bus, message):
         t = message.type
-        if t == Gst.MESSAGE_EOS:
+        if t == Gst.MessageType.EOS:
             self.eos()
-        elif t == Gst.MESSAGE_ERROR:
+        elif t == Gst.MessageType.ERROR:
+            from playitslowly import myGtk
             myGtk.show_error("Gstreamer error: %s - %s" % message.parse_error())
+        elif t == Gst.MessageType.DURATION_CHANGED:
+            self._duration = None
+        elif t == Gst.MessageType.SEGMENT_DONE:
+            if self.loop:
+                # not flushing, the start of the loop is queued right
+                # behind its end without a gap
+                self._segment_seek(Gst.SeekFlags.NONE, *self.loop)
+        elif t == Gst.MessageType.ASYNC_DONE:
+            self._position = None
+            if self._pending_seek is not None:
+                pos, self._pending_seek = self._pending_seek, None
+                self.seek(pos)
+            if self._duration is None:
+                self.get_duration()
+
+    def query_position_cached(self):
+        """
+        return the position in pipeline time. While playing the pipeline is
+        queried at most every POSITION_QUERY_INTERVAL, in between the position
+        is extrapolated from the wall clock.
+        """
+        now = time.monotonic()
+        if self._position is not None:
+            then, position = self._position
+            if not self.playing:
+                return position
+            if now - then < POSITION_QUERY_INTERVAL:
+                return position + int((now - then) * Gst.SECOND)
+        ok, position = self.playbin.query_position(Gst.Format.TIME)
+        if not ok:
+            return None
+        self._position = (now, position)
+        return position
+
+    def get_duration(self):
+        """return the duration of the song in seconds or None if unknown, queried only once"""
+        if self._duration is None:
+            ok, duration = self.playbin.query_duration(Gst.Format.TIME)
+            if ok and duration > 0:
+                # duration queries are answered upstream, the pitch element
+                # scales them by its tempo at the time of the query. Caching
+                # the song duration keeps it right when the tempo changes,
+                # rounded to 1 ms so requerying at another tempo gives the
+                # same value.
+                self._duration = round(duration*self.get_speed()/Gst.SECOND, 3)
+        return self._duration
+
+    def get_position(self):
+        """return the current song position in seconds or None if unknown"""
+        position = self.query_position_cached()
+        if position is None:
+            return None
+        position = self.song_time(position)
+        duration = self.get_duration()
+        if duration is not None:
+            position = min(position, duration)
+        return position
+
+    def set_loop(self, start, end):
+        """
+        loop between the song positions start and end (in seconds), the loop
+        takes effect with the next seek. None or an empty range disables it.
+        """
+        if start is None or end is None or end <= start:
+            self.loop = None
+        else:
+            self.loop = (start, end)
+
+    @trace.traced("seek")
+    def seek(self, pos):
+        """seek to the song position pos (in seconds)"""
+        _, state, pending = self.get_state(0)
+        if state < Gst.State.PAUSED:
+            # seeks are lost before the pipeline prerolled, do it afterwards
+            self._pending_seek = pos
+            return
+        if self.loop:
+            start, end = self.loop
+            if not start <= pos < end:
+                pos = start
+            self._segment_seek(Gst.SeekFlags.FLUSH, pos, end)
+        else:
+            pipe_pos = self._start_segment(pos)
+            self.playbin.seek_simple(Gst.Format.TIME, Gst.SeekFlags.FLUSH, pipe_pos)
+            self._position = (time.monotonic(), pipe_pos)
+
+    def _start_segment(self, pos):
+        """
+        return the pipeline time to seek to for the song position pos. The
+        pitch element scales seeks by its current tempo, so a new segment
+        restarts the position mapping.
+        """
+        pipe_pos = int(pos/self.get_speed()*Gst.SECOND)
+        self._anchor = (pipe_pos, pos)
+        return pipe_pos
+
+    def _segment_seek(self, flags, start, end):
+        """play from start to end and post SEGMENT_DONE instead of EOS"""
+        pipe_end = int(end/self.get_speed()*Gst.SECOND)
+        pipe_start = self._start_segment(start)
+        self.playbin.seek(1.0, Gst.Format.TIME,
+                flags | Gst.SeekFlags.SEGMENT | Gst.SeekFlags.ACCURATE,
+                Gst.SeekType.SET, pipe_start,
+                Gst.SeekType.SET, pipe_end)
+        self._position = (time.monotonic(), pipe_start)
 
     def set_volume(self, volume):
         self.playbin.set_property("volume", volume)
 
     def set_speed(self, speed):
+        """change the tempo live, without seeking"""
+        position = self.query_position_cached()
+        if position is not None:
+            # the song position advances at the new rate from here on
+            self._anchor = (position, self.song_time(position))
         self.speedchanger.set_property("tempo", speed)
 
     def get_speed(self):
@@ -85,61 +238,259 @@ class Pipeline(Gst.Pipeline):
 
     def pipe_time(self, t):
         """convert from song position to pipeline time"""
-        return t/self.get_speed()*1000000000
+        pipe_anchor, song_anchor = self._anchor
+        return pipe_anchor + (t - song_anchor)/self.get_speed()*1000000000
 
     def song_time(self, t):
         """convert from pipetime time to song position"""
-        return t*self.get_speed()/1000000000
+        pipe_anchor, song_anchor = self._anchor
+        return song_anchor + (t - pipe_anchor)*self.get_speed()/1000000000
 
     def set_pitch(self, pitch):
         self.speedchanger.set_property("pitch", pitch)
 
-    def save_file(self, uri):
-        pipeline = Gst.Pipeline()
-
-        playbin = Gst.ElementFactory.make("playbin")
-        pipeline.add(playbin)
-        playbin.set_property("uri", self.playbin.get_property("uri"))
-
-        bin = Gst.Bin()
-
-        speedchanger = Gst.ElementFactory.make("pitch")
-        speedchanger.set_property("tempo", self.speedchanger.get_property("tempo"))
-        speedchanger.set_property("pitch", self.speedchanger.get_property("pitch"))
-        bin.add(speedchanger)
-
-        audioconvert = Gst.ElementFactory.make("audioconvert")
-        bin.add(audioconvert)
-
-        encoder = Gst.ElementFactory.make("wavenc")
-        bin.add(encoder)
-
-        filesink = Gst.ElementFactory.make("filesink")
-        bin.add(filesink)
-        filesink.set_property("location", uri)
-
-        speedchanger.link(audioconvert)
-        audioconvert.link(encoder)
-        encoder.link(filesink)
-
-        sink_pad = Gst.GhostPad.new("sink", speedchanger.get_static_pad("sink"))
-        bin.add_pad(sink_pad)
-        playbin.set_property("audio-sink", bin)
-
-        pipeline.set_state(Gst.State.PLAYING)
-
-        return (pipeline, playbin)
+    def save_file(self, uri, start=None, end=None):
+        """
+        return an ExportPipeline saving the current file with the current
+        settings to uri, limited to the song positions start to end if given.
+        It has to be started with start() or by an ExportQueue.
+        """
+        pipeline = ExportPipeline(self.playbin.get_property("uri"), uri,
+                self.speedchanger.get_property("tempo"),
+                self.speedchanger.get_property("pitch"),
+                start=start, end=end)
+        return pipeline
 
     def set_file(self, uri):
+        if uri != self.playbin.get_property("uri"):
+            self._duration = None
+            self._anchor = (0, 0.0)
+        self._position = None
         self.playbin.set_property("uri", uri)
 
     def play(self):
+        self._position = None
+        self.playing = True
         self.set_state(Gst.State.PLAYING)
 
     def pause(self):
+        self._position = None
+        self.playing = False
         self.set_state(Gst.State.PAUSED)
 
     def reset(self):
+        self.loop = None
+        self._anchor = (0, 0.0)
+        self._pending_seek = None
+        self._position = None
+        self._duration = None
+        self.playing = False
         self.set_state(Gst.State.READY)
 
 
+def available_export_formats():
+    """return the export formats whose gstreamer elements are installed"""
+    return [name for name, (encoder, muxer, configure) in EXPORT_FORMATS.items()
+            if Gst.ElementFactory.find(encoder) and (muxer is None or Gst.ElementFactory.find(muxer))]
+
+
+def export_format_for(location):
+    """guess the export format from the extension of location"""
+    extension = os.path.splitext(location)[1].lstrip(".").lower()
+    if extension == "oga":
+        extension = "ogg"
+    if extension not in EXPORT_FORMATS:
+        raise ValueError("unsupported export format %r, use one of: %s" % (
+            extension, ", ".join(available_export_formats())))
+    return extension
+
+
+class ExportPipeline(Gst.Pipeline):
+    """
+    Renders source_uri with the given tempo and pitch (as a frequency ratio)
+    into the file location, encoded as export_format (by default guessed from
+    the extension of location). If start or end (song positions in seconds)
+    are given only that region of the song is decoded and exported. Nothing
+    in the pipeline is synchronised to a clock, so it runs as fast as the
+    decoder and the pitch element allow.
+    """
+    def __init__(self, source_uri, location, tempo, pitch, export_format=None,
+            quality=DEFAULT_EXPORT_QUALITY, start=None, end=None):
+        Gst.Pipeline.__init__(self)
+
+        decoder = Gst.ElementFactory.make("uridecodebin")
+        decoder.set_property("uri", source_uri)
+        decoder.connect("pad-added", self.on_pad_added)
+        decoder.connect("no-more-pads", self.on_no_more_pads)
+        self.add(decoder)
+
+        self.location = location
+        elements = self.make_elements(["audioconvert", "audioresample", "pitch",
+                "audioconvert", "audioresample"]) + self.make_output(export_format, quality)
+        self.convert, speedchanger = elements[0], elements[2]
+        speedchanger.set_property("tempo", tempo)
+        speedchanger.set_property("pitch", pitch)
+        for element in elements:
+            self.add(element)
+        for a, b in zip(elements, elements[1:]):
+            a.link(b)
+
+        self.tempo = tempo
+        # the region in output time, the pitch element scales seeks by the tempo
+        self.region = None
+        if start or end:
+            self.region = ((start or 0.0)/tempo, end/tempo if end else None)
+        self.prerolling = False
+        self.started = None
+        self.cancelled = False
+        self.finished = False
+        self.error = None
+        self.duration = 0.0
+        self.watched = False
+        self.trace_name = "export"
+        # called with the pipeline once it finished or failed
+        self.done = lambda pipeline: None
+
+    def make_elements(self, names):
+        """create the gstreamer elements called names, None entries are skipped"""
+        elements = [Gst.ElementFactory.make(name) for name in names if name]
+        if None in elements:
+            missing = [name for name in names if name and not Gst.ElementFactory.find(name)]
+            raise ValueError("missing gstreamer element for the export: %s" % ", ".join(missing))
+        return elements
+
+    def make_output(self, export_format, quality):
+        """return the elements after the pitch element, encoding into location"""
+        self.export_format = export_format or export_format_for(self.location)
+        encoder_name, muxer_name, configure = EXPORT_FORMATS[self.export_format]
+        elements = self.make_elements([encoder_name, muxer_name, "filesink"])
+        if configure:
+            configure(elements[0], quality)
+        filesink = elements[-1]
+        filesink.set_property("location", self.location)
+        filesink.set_property("sync", False)
+        return elements
+
+    def on_pad_added(self, decoder, pad):
+        sink_pad = self.convert.get_static_pad("sink")
+        caps = pad.get_current_caps() or pad.query_caps(None)
+        if not sink_pad.is_linked() and caps.to_string().startswith("audio/"):
+            pad.link(sink_pad)
+
+    def on_no_more_pads(self, decoder):
+        if not self.convert.get_static_pad("sink").is_linked():
+            error = GLib.Error.new_literal(Gst.StreamError.quark(),
+                    "no audio stream found", int(Gst.StreamError.TYPE_NOT_FOUND))
+            self.post_message(Gst.Message.new_error(self, error, None))
+
+    def start(self):
+        """start exporting in the background, done is called from the main loop"""
+        bus = self.get_bus()
+        bus.add_signal_watch()
+        bus.connect("message", self.on_message)
+        self.watched = True
+        self.started = time.monotonic()
+        if self.region:
+            # the region is seeked to once the pipeline prerolled
+            self.prerolling = True
+            self.set_state(Gst.State.PAUSED)
+        else:
+            self.set_state(Gst.State.PLAYING)
+
+    def run(self, progress=None, interval=0.5):
+        """
+        export and block until it finished. progress is called with
+        (position, duration) in seconds every interval seconds.
+        """
+        bus = self.get_bus()
+        self.started = time.monotonic()
+        if self.region:
+            self.set_state(Gst.State.PAUSED)
+            if self.get_state(Gst.CLOCK_TIME_NONE)[0] != Gst.StateChangeReturn.FAILURE:
+                self.seek_region()
+        self.set_state(Gst.State.PLAYING)
+        while not self.finished:
+            message = bus.timed_pop_filtered(int(interval*Gst.SECOND),
+                    Gst.MessageType.EOS | Gst.MessageType.ERROR)
+            if message is None:
+                if progress:
+                    progress(*self.query_progress())
+            else:
+                self.handle_message(message)
+
+    def on_message(self, bus, message):
+        self.handle_message(message)
+
+    def seek_region(self):
+        """restrict the export to the region, only that part gets decoded"""
+        start, end = self.region
+        self.seek(1.0, Gst.Format.TIME, Gst.SeekFlags.FLUSH | Gst.SeekFlags.ACCURATE,
+                Gst.SeekType.SET, int(start*Gst.SECOND),
+                Gst.SeekType.SET if end else Gst.SeekType.NONE,
+                int(end*Gst.SECOND) if end else -1)
+
+    def handle_message(self, message):
+        if message.type == Gst.MessageType.ASYNC_DONE and self.prerolling:
+            self.prerolling = False
+            self.seek_region()
+            self.set_state(Gst.State.PLAYING)
+            return
+        if message.type == Gst.MessageType.EOS:
+            self.stop()
+        elif message.type == Gst.MessageType.ERROR:
+            error, debug = message.parse_error()
+            self.error = error.message
+            self.stop()
+        else:
+            return
+        self.done(self)
+
+    def query_progress(self):
+        """return the (position, duration) of the exported output in seconds"""
+        ok_pos, position = self.query_position(Gst.Format.TIME)
+        ok_dur, duration = self.query_duration(Gst.Format.TIME)
+        position = position/Gst.SECOND if ok_pos else 0.0
+        duration = duration/Gst.SECOND if ok_dur else 0.0
+        if self.region:
+            start, end = self.region
+            duration = (end or duration) - start
+            position = max(0.0, position - start)
+        return (position, duration)
+
+    def get_status(self):
+        """
+        return (fraction done, realtime factor, estimated seconds left), the
+        latter two are None until they can be estimated
+        """
+        position, duration = self.query_progress()
+        fraction = min(1.0, position/duration) if duration > 0 else 0.0
+        elapsed = time.monotonic() - self.started if self.started else 0.0
+        if position <= 0 or elapsed <= 0:
+            return (fraction, None, None)
+        speed = position/elapsed
+        return (fraction, speed, max(0.0, duration - position)/speed if duration > 0 else None)
+
+    def cancel(self):
+        """stop exporting and remove the incomplete file"""
+        if not self.finished:
+            self.cancelled = True
+            self.stop()
+            try:
+                if self.location:
+                    os.unlink(self.location)
+            except OSError:
+                pass
+
+    def stop(self):
+        """stop exporting and release all resources"""
+        if not self.finished:
+            self.finished = True
+            self.duration = self.query_progress()[1]
+            if self.started:
+                now = time.perf_counter()
+                trace.record(self.trace_name, now - (time.monotonic() - self.started), now,
+                        {"location": self.location, "error": self.error})
+            self.set_state(Gst.State.NULL)
+            if self.watched:
+                self.get_bus().remove_signal_watch()
+                self.watched = False
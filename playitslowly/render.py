@@ -0,0 +1,172 @@
+# playitslowly/render.py
+"""
+Offscreen rendering of the waveform for Play it Slowly.
+
+- The min/max columns of the visible range are rasterised with NumPy into an
+  ARGB32 pixel buffer which is wrapped by a cairo ImageSurface.
+- The channels can be drawn combined or each in its own lane, optionally with
+  the RMS of every column drawn on top of the peaks. Both only read another
+  view of the envelope, switching does not decode the file again.
+- WaveformRenderer keeps the last surface and only renders it again when the
+  waveform, the visible range, the vertical zoom or the widget size change.
+- On top of that it caches a static layer with the loop selection and its
+  markers, so a frame during playback only needs to blit this layer and draw
+  the playback position.
+"""
+
+import cairo
+import numpy as np
+
+BACKGROUND_COLOR = (0.1, 0.1, 0.1)
+WAVEFORM_COLOR = (0.2, 0.6, 1.0)
+RMS_COLOR = (0.55, 0.8, 1.0)
+SELECTION_COLOR = (0.9, 0.3, 0.4, 0.25)
+MARKER_COLOR = (1.0, 0.6, 0.0)
+
+
+def pack_color(rgb):
+    """convert an (r, g, b) tuple to an opaque native-endian ARGB32 pixel"""
+    r, g, b = (int(round(c * 255)) for c in rgb)
+    return np.uint32(0xff000000 | r << 16 | g << 8 | b)
+
+
+def rasterize_columns(mins, maxs, width, height, amp, rms=None, pixels=None):
+    """
+    Return a (height, width) uint32 ARGB32 pixel array with one vertical span
+    per column from mins to maxs (normalised to [-1, 1], scaled by amp pixels)
+    and, if rms is given, a lighter span from -rms to rms on top of it.
+    Columns past the end of mins are left empty. If pixels is given the
+    columns are drawn into it instead of a new array, e.g. into one lane of a
+    larger one.
+    """
+    if pixels is None:
+        pixels = np.empty((height, width), dtype=np.uint32)
+        pixels.fill(pack_color(BACKGROUND_COLOR))
+    columns = min(len(mins), width)
+    if columns == 0 or height == 0:
+        return pixels
+
+    mid = height // 2
+    top = mid - np.rint(maxs[:columns] * amp).astype(np.intp)
+    bottom = mid - np.rint(mins[:columns] * amp).astype(np.intp)
+    # connect every column to its left neighbour like a continuous line
+    top[1:], bottom[1:] = (np.minimum(top[1:], bottom[:-1]),
+            np.maximum(bottom[1:], top[:-1]))
+    np.clip(top, 0, height - 1, out=top)
+    np.clip(bottom, 0, height - 1, out=bottom)
+
+    rows = np.arange(height)[:, None]
+    mask = (rows >= top) & (rows <= bottom)
+    pixels[:, :columns][mask] = pack_color(WAVEFORM_COLOR)
+
+    if rms is not None:
+        extent = np.rint(rms[:columns] * amp).astype(np.intp)
+        mask = np.abs(rows - mid) <= extent
+        pixels[:, :columns][mask] = pack_color(RMS_COLOR)
+    return pixels
+
+
+def surface_from_pixels(pixels, scale=1):
+    """wrap an ARGB32 pixel array in a cairo ImageSurface without copying it"""
+    height, width = pixels.shape
+    stride = cairo.ImageSurface.format_stride_for_width(cairo.FORMAT_ARGB32, width)
+    assert stride == pixels.strides[0]
+    surface = cairo.ImageSurface.create_for_data(pixels, cairo.FORMAT_ARGB32,
+            width, height, stride)
+    if scale != 1:
+        surface.set_device_scale(scale, scale)
+    return surface
+
+
+class WaveformRenderer:
+    def __init__(self):
+        self._key = None
+        self._surface = None
+        self._pixels = None
+        self._layer_key = None
+        self._layer = None
+
+    def render(self, waveform, fraction, view_start, view_end, width, height,
+            vertical_zoom=1.0, scale=1, split_channels=False, show_rms=False):
+        """
+        Return a surface showing the [view_start, view_end) fraction of the
+        track, of which waveform covers the first fraction, or None if there is
+        nothing to draw. With split_channels every channel gets a lane of its
+        own, with show_rms the RMS is drawn over the peaks.
+        """
+        key = (waveform, fraction, view_start, view_end, width, height,
+                vertical_zoom, scale, split_channels, show_rms)
+        if key == self._key:
+            return self._surface
+
+        surface = None
+        view_width = view_end - view_start
+        covered = min(view_end, fraction) - view_start
+        pixel_width, pixel_height = width * scale, height * scale
+        columns = int(pixel_width * min(1.0, covered / view_width))
+        if columns > 0:
+            start, end = view_start / fraction, min(view_end, fraction) / fraction
+            lanes = waveform.channels if split_channels else 1
+            lane_height = pixel_height // lanes
+            amp = int((lane_height // 2 - 2 * scale) * vertical_zoom)
+            pixels = np.empty((pixel_height, pixel_width), dtype=np.uint32)
+            pixels.fill(pack_color(BACKGROUND_COLOR))
+            for lane in range(lanes):
+                channel = lane if split_channels else None
+                mins, maxs = waveform.get_view(start, end, columns, channel)
+                if len(mins) < 2:
+                    break
+                rms = waveform.get_rms_view(start, end, columns, channel) if show_rms else None
+                rasterize_columns(mins, maxs, pixel_width, lane_height, amp, rms,
+                        pixels[lane * lane_height:(lane + 1) * lane_height])
+            else:
+                self._pixels = pixels
+                surface = surface_from_pixels(pixels, scale)
+
+        self._key = key
+        self._surface = surface
+        return surface
+
+    def render_layer(self, waveform, fraction, view_start, view_end, width, height,
+            vertical_zoom=1.0, scale=1, selection=None, split_channels=False,
+            show_rms=False):
+        """
+        Return a surface with the waveform and, if selection is a (start, end)
+        tuple of track fractions, the translucent loop region and its markers.
+        """
+        surface = self.render(waveform, fraction, view_start, view_end, width,
+                height, vertical_zoom, scale, split_channels, show_rms)
+        key = (surface, selection)
+        if key == self._layer_key:
+            return self._layer
+        self._layer_key = key
+        if surface is None or selection is None:
+            self._layer = surface
+            return surface
+
+        layer = cairo.ImageSurface(cairo.FORMAT_ARGB32, width * scale, height * scale)
+        if scale != 1:
+            layer.set_device_scale(scale, scale)
+        cr = cairo.Context(layer)
+        cr.set_antialias(cairo.ANTIALIAS_NONE)
+        cr.set_source_surface(surface, 0, 0)
+        cr.paint()
+
+        x1, x2 = ((f - view_start) / (view_end - view_start) * width for f in selection)
+
+        # --- Selection (loop region) overlay ---
+        cr.set_source_rgba(*SELECTION_COLOR)
+        cr.rectangle(min(x1, x2), 0, abs(x2 - x1), height)
+        cr.fill()
+
+        # --- Start/End marker lines (contrasting color) ---
+        cr.set_source_rgb(*MARKER_COLOR)
+        cr.set_line_width(1.2)
+        for xline in (x1, x2):
+            if 0 <= xline <= width:
+                cr.move_to(xline, 0)
+                cr.line_to(xline, height)
+        cr.stroke()
+
+        self._layer = layer
+        return layer
@@ -0,0 +1,84 @@
+# playitslowly/settingsstore.py
+"""
+Per-file settings of Play it Slowly.
+
+- The settings of every opened file (speed, pitch, loop, volume) are kept in
+  a SQLite database indexed by the URI of the file, so loading or saving the
+  settings of one file costs the same no matter how many files were opened.
+- The database is only opened on the first access, not while starting up.
+- Every access records when the file was used last. Once more than
+  max_entries files are stored the least recently used ones are removed.
+- migrate() moves the "files" dictionary of older config files into the store.
+"""
+
+import json
+import sqlite3
+import time
+
+DEFAULT_MAX_ENTRIES = 1000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    uri TEXT PRIMARY KEY,
+    settings TEXT NOT NULL,
+    used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS files_used ON files (used);
+"""
+
+
+class SettingsStore:
+    def __init__(self, path, max_entries=DEFAULT_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self._db = None
+
+    @property
+    def db(self):
+        if self._db is None:
+            self._db = sqlite3.connect(self.path)
+            # a commit does not need to wait for the disk, only for the log
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.executescript(SCHEMA)
+        return self._db
+
+    def __len__(self):
+        return self.db.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+
+    def get(self, uri):
+        """return the settings dict of uri or None if there are none"""
+        with self.db:
+            row = self.db.execute("SELECT settings FROM files WHERE uri = ?", (uri,)).fetchone()
+            if row is None:
+                return None
+            self.db.execute("UPDATE files SET used = ? WHERE uri = ?", (time.time(), uri))
+        return json.loads(row[0])
+
+    def put(self, uri, settings):
+        """store the settings dict of uri, evicting the least recently used files"""
+        with self.db:
+            self.db.execute("INSERT OR REPLACE INTO files (uri, settings, used) VALUES (?, ?, ?)",
+                    (uri, json.dumps(settings), time.time()))
+            self.evict()
+
+    def migrate(self, files):
+        """add the settings of the {uri: settings} dict files that are not stored yet"""
+        # older entries come first, keep that order as the order of use
+        now = time.time() - len(files)
+        with self.db:
+            self.db.executemany("INSERT OR IGNORE INTO files (uri, settings, used) VALUES (?, ?, ?)",
+                    ((uri, json.dumps(settings), now + i)
+                     for i, (uri, settings) in enumerate(files.items()) if uri))
+            self.evict()
+
+    def evict(self):
+        """remove the least recently used files beyond max_entries"""
+        self.db.execute("DELETE FROM files WHERE uri IN "
+                "(SELECT uri FROM files ORDER BY used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,))
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
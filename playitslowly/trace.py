@@ -0,0 +1,183 @@
+# playitslowly/trace.py
+"""
+Opt-in timing instrumentation for Play it Slowly.
+
+- Enabled by setting PLAYITSLOWLY_TRACE or passing --trace. While disabled
+  span() hands out a shared no-op context manager and traced functions are
+  called directly, so the instrumented hot paths stay cheap.
+- Every span is added to a histogram of its name with power of two buckets.
+  The histograms are printed to stderr when the program exits.
+- If PLAYITSLOWLY_TRACE (or --trace=FILE) names a file, all spans are written
+  to it as Chrome trace events at exit, it can be opened with
+  chrome://tracing or https://ui.perfetto.dev.
+"""
+
+import atexit
+import functools
+import json
+import os
+import sys
+import threading
+import time
+
+ENV_VAR = "PLAYITSLOWLY_TRACE"
+# the number of spans kept for the trace file, later ones are only counted
+MAX_EVENTS = 1000000
+
+
+class Histogram:
+    """durations in seconds, bucketed by powers of two of microseconds"""
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = float("inf")
+        self.max = 0.0
+        self.buckets = {}
+
+    def add(self, duration):
+        self.count += 1
+        self.total += duration
+        self.min = min(self.min, duration)
+        self.max = max(self.max, duration)
+        bucket = max(0, int(duration*1e6)).bit_length()
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+
+    def percentile(self, fraction):
+        """return the upper bound of the bucket holding the given fraction of the spans"""
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= fraction*self.count:
+                return min(self.max, (1 << bucket)/1e6)
+        return self.max
+
+
+class _Span:
+    __slots__ = ("tracer", "name", "args", "started")
+
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.tracer.record(self.name, self.started, time.perf_counter(), self.args)
+        return False
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+NULL_SPAN = _NullSpan()
+
+
+class Tracer:
+    def __init__(self):
+        self.enabled = False
+        self.path = None
+        self.origin = time.perf_counter()
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.events = []
+
+    def enable(self, path=None):
+        """start recording, write the trace events to path at exit if given"""
+        if not self.enabled:
+            atexit.register(self.dump)
+        self.enabled = True
+        self.path = path or self.path
+
+    def span(self, name, **args):
+        """return a context manager recording the time spent in it as name"""
+        if not self.enabled:
+            return NULL_SPAN
+        return _Span(self, name, args)
+
+    def record(self, name, started, ended, args=None):
+        """record a span from the perf_counter values started to ended"""
+        if not self.enabled:
+            return
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.add(ended - started)
+            if self.path and len(self.events) < MAX_EVENTS:
+                self.events.append((name, started, ended, threading.get_ident(), args))
+
+    def traced(self, name):
+        """decorator recording every call of a function as name"""
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return function(*args, **kwargs)
+                started = time.perf_counter()
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    self.record(name, started, time.perf_counter())
+            return wrapper
+        return decorator
+
+    def report(self, out=sys.stderr):
+        """print a table of all histograms in milliseconds"""
+        with self.lock:
+            histograms = sorted(self.histograms.items())
+        print("%-20s %8s %10s %9s %9s %9s %9s" % (
+            "span", "count", "total", "mean", "p50", "p95", "max"), file=out)
+        for name, h in histograms:
+            print("%-20s %8d %10.1f %9.3f %9.3f %9.3f %9.3f" % (
+                name, h.count, h.total*1000, h.total/h.count*1000,
+                h.percentile(0.5)*1000, h.percentile(0.95)*1000, h.max*1000), file=out)
+
+    def write_chrome_trace(self, path):
+        """write all spans as complete ("X") events of the Chrome trace event format"""
+        pid = os.getpid()
+        with self.lock:
+            events = [{"name": name, "ph": "X", "pid": pid, "tid": tid,
+                       "ts": (started - self.origin)*1e6, "dur": (ended - started)*1e6,
+                       "args": args or {}}
+                      for name, started, ended, tid, args in self.events]
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+    def dump(self):
+        self.report()
+        if self.path:
+            try:
+                self.write_chrome_trace(self.path)
+            except (IOError, OSError) as e:
+                print("Could not write the trace to %s: %s" % (self.path, e), file=sys.stderr)
+            else:
+                print("Trace written to %s" % self.path, file=sys.stderr)
+
+
+tracer = Tracer()
+span = tracer.span
+record = tracer.record
+traced = tracer.traced
+
+
+def handle_options(argv):
+    """
+    enable tracing if argv has a --trace[=FILE] option and remove it, it is
+    understood by every mode so it is taken out before the options are parsed
+    """
+    for arg in argv[1:]:
+        if arg == "--trace" or arg.startswith("--trace="):
+            argv.remove(arg)
+            tracer.enable(arg.partition("=")[2] or None)
+
+if os.environ.get(ENV_VAR):
+    # PLAYITSLOWLY_TRACE=1 only prints the histograms
+    value = os.environ[ENV_VAR]
+    tracer.enable(None if value == "1" else value)
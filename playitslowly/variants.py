@@ -0,0 +1,270 @@
+# playitslowly/variants.py
+"""
+Pre-rendered practice variants of the loop for Play it Slowly.
+
+- RenderPipeline renders the loop at a single tempo/pitch into raw PCM in
+  memory. It is an ExportPipeline with an appsink instead of an encoder, so
+  it runs as fast as the decoder and the pitch element allow.
+- VariantCache renders a set of tempo/pitch combinations one after the other
+  in the background and keeps the results in a least recently used cache
+  with a size limit.
+- LoopPlayer plays a rendered loop over and over through appsrc. Switching to
+  another cached variant only swaps the PCM it reads from, so it is instant
+  and playing needs no time stretching at all.
+"""
+
+import collections
+import threading
+
+from playitslowly.pipeline import Gst, GLib, ExportPipeline
+from playitslowly.export import ExportQueue
+
+RATE = 44100
+CHANNELS = 2
+# bytes per frame of interleaved S16LE
+FRAME_SIZE = 2 * CHANNELS
+CAPS = "audio/x-raw,format=S16LE,layout=interleaved,rate=%d,channels=%d" % (RATE, CHANNELS)
+# number of frames pushed into the appsrc at once, bounds the switching latency
+CHUNK_FRAMES = 2048
+# the default limit of the cache in bytes, about 12 minutes of audio
+DEFAULT_CACHE_SIZE = 128 << 20
+# (tempo, semitones) rendered in addition to the current setting
+DEFAULT_VARIANTS = [(0.5, 0.0), (0.6, 0.0), (0.7, 0.0), (0.8, 0.0), (0.9, 0.0), (1.0, 0.0)]
+
+
+def variant_key(uri, start, end, tempo, semitones):
+    """return the cache key of a variant, rounded to what the sliders can set"""
+    return (uri, round(start, 3), round(end, 3), round(tempo, 3), round(semitones, 2))
+
+
+class RenderPipeline(ExportPipeline):
+    """
+    renders the region of source_uri into memory, see pcm(). Rendering fails
+    once more than max_size bytes were collected.
+    """
+    def __init__(self, source_uri, tempo, pitch, start=None, end=None, max_size=None):
+        ExportPipeline.__init__(self, source_uri, None, tempo, pitch, start=start, end=end)
+        self.key = None
+        self.trace_name = "prerender"
+        self.max_size = max_size
+        self.size = 0
+        self.overflowed = False
+
+    def make_output(self, export_format, quality):
+        self.export_format = None
+        self.chunks = []
+        capsfilter, appsink = self.make_elements(["capsfilter", "appsink"])
+        capsfilter.set_property("caps", Gst.Caps.from_string(CAPS))
+        appsink.set_property("sync", False)
+        appsink.set_property("emit-signals", True)
+        appsink.connect("new-sample", self.on_new_sample)
+        return [capsfilter, appsink]
+
+    def on_new_sample(self, appsink):
+        # called from the streaming thread
+        buffer = appsink.emit("pull-sample").get_buffer()
+        if self.overflowed:
+            return Gst.FlowReturn.EOS
+        self.size += buffer.get_size()
+        if self.max_size is not None and self.size > self.max_size:
+            # it would not fit into the cache anyway, stop collecting
+            self.overflowed = True
+            self.chunks = []
+            error = GLib.Error.new_literal(Gst.StreamError.quark(),
+                    "the rendered loop is larger than %d bytes" % self.max_size,
+                    int(Gst.StreamError.FAILED))
+            self.post_message(Gst.Message.new_error(self, error, None))
+            return Gst.FlowReturn.EOS
+        self.chunks.append(buffer.extract_dup(0, buffer.get_size()))
+        return Gst.FlowReturn.OK
+
+    def pcm(self):
+        """return the rendered PCM and release the chunks it was collected in"""
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+class VariantCache:
+    """
+    Least recently used cache of rendered loops by variant_key, holding at most
+    max_size bytes of PCM. rendered is called with the key of every variant
+    that was added to the cache.
+    """
+    def __init__(self, max_size=DEFAULT_CACHE_SIZE):
+        self.max_size = max_size
+        self.size = 0
+        self.entries = collections.OrderedDict()
+        self.queue = ExportQueue()
+        self.queue.finished = self.on_finished
+        self.rendered = lambda key: None
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def get(self, key):
+        """return the PCM of key or None if it was not rendered (yet)"""
+        data = self.entries.get(key)
+        if data is not None:
+            self.entries.move_to_end(key)
+        return data
+
+    def put(self, key, data):
+        if key in self.entries:
+            self.size -= len(self.entries.pop(key))
+        if len(data) > self.max_size:
+            return
+        self.entries[key] = data
+        self.size += len(data)
+        while self.size > self.max_size:
+            old_key, old = self.entries.popitem(last=False)
+            self.size -= len(old)
+
+    def prepare(self, uri, start, end, variants):
+        """
+        render the loop from start to end of uri at every (tempo, semitones)
+        in variants that is not cached yet, replacing all pending renderings.
+        Variants larger than the whole cache are skipped.
+        """
+        self.cancel()
+        for tempo, semitones in variants:
+            key = variant_key(uri, start, end, tempo, semitones)
+            if key in self.entries or any(p.key == key for p in self.queue.pending):
+                continue
+            if (end - start) / key[3] * RATE * FRAME_SIZE > self.max_size:
+                continue
+            pipeline = RenderPipeline(uri, key[3], 2**(key[4]/12.0), key[1], key[2],
+                    self.max_size)
+            pipeline.key = key
+            self.queue.add(pipeline)
+
+    def on_finished(self, pipeline):
+        data = pipeline.pcm()
+        if pipeline.error or pipeline.cancelled or not data:
+            return
+        self.put(pipeline.key, data)
+        if pipeline.key in self.entries:
+            self.rendered(pipeline.key)
+
+    def cancel(self):
+        """stop rendering"""
+        self.queue.cancel()
+
+
+class LoopPlayer(Gst.Pipeline):
+    """
+    Plays a rendered loop from start to end (song positions in seconds) over
+    and over. The PCM is pushed in chunks from the need-data signal, switch()
+    and seek() take effect with the next chunk.
+    """
+    def __init__(self, sink):
+        Gst.Pipeline.__init__(self)
+        self.source = Gst.ElementFactory.make("appsrc")
+        self.source.set_property("caps", Gst.Caps.from_string(CAPS))
+        self.source.set_property("format", Gst.Format.TIME)
+        self.source.set_property("max-bytes", 2 * CHUNK_FRAMES * FRAME_SIZE)
+        self.source.connect("need-data", self.on_need_data)
+        convert = Gst.ElementFactory.make("audioconvert")
+        self.volume = Gst.ElementFactory.make("volume")
+        self.audiosink = Gst.parse_launch(sink)
+        elements = [self.source, convert, self.volume, self.audiosink]
+        for element in elements:
+            self.add(element)
+        for a, b in zip(elements, elements[1:]):
+            a.link(b)
+
+        self.lock = threading.Lock()    # guards everything need-data reads
+        self.data = b""
+        self.tempo = 1.0
+        self.start = 0.0
+        self.end = 0.0
+        self.offset = 0                 # byte offset of the next chunk in data
+        self.frames = 0                 # frames pushed since play()
+        # (timestamp, offset, tempo) of the chunks queued in front of the sink
+        self.pushed = collections.deque(maxlen=256)
+        self.playing = False
+
+        bus = self.get_bus()
+        bus.add_signal_watch()
+        bus.connect("message", self.on_message)
+
+    def on_message(self, bus, message):
+        if message.type == Gst.MessageType.ERROR:
+            self.stop()
+            from playitslowly import myGtk
+            myGtk.show_error("Gstreamer error: %s - %s" % message.parse_error())
+
+    def on_need_data(self, source, length):
+        # called from the streaming thread
+        with self.lock:
+            if not self.data:
+                return
+            chunk = self.data[self.offset:self.offset + CHUNK_FRAMES * FRAME_SIZE]
+            timestamp = self.frames * Gst.SECOND // RATE
+            self.pushed.append((timestamp, self.offset, self.tempo))
+            self.frames += len(chunk) // FRAME_SIZE
+            self.offset += len(chunk)
+            if self.offset >= len(self.data):
+                self.offset = 0
+            buffer = Gst.Buffer.new_wrapped(chunk)
+            buffer.pts = timestamp
+            buffer.duration = self.frames * Gst.SECOND // RATE - timestamp
+        source.emit("push-buffer", buffer)
+
+    def _offset_for(self, position, tempo, data):
+        """return the byte offset of the song position in data rendered at tempo"""
+        offset = max(0, int((position - self.start) / tempo * RATE)) * FRAME_SIZE
+        return offset if offset < len(data) else 0
+
+    def play(self, data, tempo, start, end, position=None):
+        """play data, the loop rendered at tempo, from the song position on"""
+        self.set_state(Gst.State.NULL)
+        with self.lock:
+            self.start, self.end = start, end
+            self.data, self.tempo = data, tempo
+            self.offset = 0
+            if position is not None and start <= position < end:
+                self.offset = self._offset_for(position, tempo, data)
+            self.frames = 0
+            self.pushed.clear()
+        self.playing = True
+        self.set_state(Gst.State.PLAYING)
+
+    def switch(self, data, tempo):
+        """continue with another variant of the same loop at the same song position"""
+        with self.lock:
+            position = self.start + self.offset / (RATE * FRAME_SIZE) * self.tempo
+            self.offset = self._offset_for(position, tempo, data)
+            self.data, self.tempo = data, tempo
+
+    def seek(self, position):
+        """continue at the song position, return False if it is outside of the loop"""
+        if not self.start <= position < self.end:
+            return False
+        with self.lock:
+            self.offset = self._offset_for(position, self.tempo, self.data)
+        return True
+
+    def get_position(self):
+        """return the song position that is currently heard"""
+        ok, now = self.query_position(Gst.Format.TIME)
+        with self.lock:
+            if not self.pushed:
+                return self.start
+            if ok:
+                while len(self.pushed) > 1 and self.pushed[1][0] <= now:
+                    self.pushed.popleft()
+            timestamp, offset, tempo = self.pushed[0]
+        elapsed = max(0, now - timestamp) / Gst.SECOND if ok else 0.0
+        return min(self.end, self.start + (offset / (RATE * FRAME_SIZE) + elapsed) * tempo)
+
+    def set_volume(self, volume):
+        self.volume.set_property("volume", volume)
+
+    def stop(self):
+        """stop playing and release the audio device and the PCM"""
+        self.playing = False
+        self.set_state(Gst.State.NULL)
+        with self.lock:
+            self.data = b""
+            self.pushed.clear()
@@ -2,60 +2,517 @@
 """
 WaveformExtractor: detailed waveform generator for Play it Slowly.
 
-- Uses pydub (FFmpeg) to support MP3, WAV, FLAC, OGG, AAC, etc.
-- Computes min/max amplitude envelopes for Cool Edit–style waveforms.
+- Decodes with a GStreamer uridecodebin ! appsink analysis pipeline, so the
+  same decoders as for playback are used and every format that can be played
+  gets a waveform. The analysis pipeline is separate from the playback one.
+  Without GStreamer FFmpeg (located through pydub) is used instead.
+- Streams the decoded PCM in fixed-size blocks and folds every block straight
+  into per-channel min/max and RMS envelopes for Cool Edit–style waveforms,
+  so memory use is bounded by the block size instead of the length of the
+  track. The PCM is only viewed through numpy and reduced in its native int16,
+  just the small envelope views are converted to float.
+- Reports its progress after every block, so the envelope decoded so far can
+  be shown while the rest of the file is still being read.
+- Keeps a min/max/RMS pyramid (every level halves the resolution of the previous
+  one) so any zoom level can be drawn from the level closest to one bin per
+  pixel at a constant cost. The finest level has one bin per BIN_SIZE
+  frames, at higher zoom levels a bin is stretched over several pixels
+  rather than showing single samples. New bins are folded onto the existing levels as
+  they are decoded, snapshots of a partly decoded file share the bins with
+  the extractor instead of copying them.
 """
 
+import os
+import subprocess
+
 import numpy as np
 
-try:
-  from pydub import AudioSegment
-except ImportError:
-  raise ImportError(
-      "pydub not found. Install it with:\n  pip install pydub\n"
-      "and ensure ffmpeg is installed (sudo apt install ffmpeg)"
-  )
+from playitslowly import trace
+
+# number of frames folded into a single envelope bin at the finest level. It
+# is the limit of the detail: zoomed in further, a bin spans several pixels.
+BIN_SIZE = 64
+# the coarsest level of the pyramid has at most this many bins
+MIN_LEVEL_SIZE = 512
+# number of bytes read from the decoder at once
+BLOCK_SIZE = 1 << 20
+# the decoded PCM handed to the envelope, in the channels of the file
+DECODE_CAPS = "audio/x-raw,format=S16LE,layout=interleaved"
+# seconds to wait for a decoded buffer before checking for errors
+PULL_TIMEOUT = 0.1
+
+
+def gstreamer():
+    """return the initialised Gst module or None if GStreamer is not available"""
+    try:
+        from playitslowly.pipeline import init_gstreamer
+    except (ImportError, ValueError):
+        return None
+    return init_gstreamer()
+
+
+def root_mean_square(bins):
+    """
+    reduce an int16 array of shape (bins, channels, frames) to the RMS of
+    every bin and channel, rounded to int16 like the min/max envelope
+    """
+    power = np.einsum("ijk,ijk->ij", bins, bins, dtype=np.float32) / bins.shape[2]
+    return np.minimum(np.rint(np.sqrt(power)), 32767).astype(np.int16)
+
+
+def halve(mins, maxs, rms):
+    """combine every two neighbouring bins of an envelope with an even number of bins"""
+    power = np.square(rms[0::2], dtype=np.float32)
+    power += np.square(rms[1::2], dtype=np.float32)
+    power *= 0.5
+    return (np.minimum(mins[0::2], mins[1::2]), np.maximum(maxs[0::2], maxs[1::2]),
+            np.rint(np.sqrt(power)).astype(np.int16))
+
+
+class _Level:
+    """
+    One level of the pyramid. Its (mins, maxs, rms) arrays have room for more
+    bins than they hold, new bins are appended after the ones in use, so
+    views of the bins in use stay valid and unchanged while the level grows.
+    """
+    def __init__(self, mins, maxs, rms):
+        self.arrays = (mins, maxs, rms)
+        self.length = len(mins)
+
+    @classmethod
+    def empty(cls, channels):
+        empty = np.empty((0, channels), dtype=np.int16)
+        return cls(empty, empty, empty)
+
+    def __len__(self):
+        return self.length
+
+    def bins(self):
+        """return views of the (mins, maxs, rms) in use"""
+        return tuple(array[:self.length] for array in self.arrays)
+
+    def reserve(self, capacity):
+        """make room for capacity bins"""
+        if capacity > len(self.arrays[0]):
+            arrays = tuple(np.empty((capacity,) + array.shape[1:], dtype=np.int16)
+                    for array in self.arrays)
+            for array, old in zip(arrays, self.arrays):
+                array[:self.length] = old[:self.length]
+            self.arrays = arrays
+
+    def append(self, mins, maxs, rms):
+        end = self.length + len(mins)
+        if end > len(self.arrays[0]):
+            self.reserve(max(end, 2 * len(self.arrays[0]), MIN_LEVEL_SIZE))
+        for array, values in zip(self.arrays, (mins, maxs, rms)):
+            array[self.length:end] = values
+        self.length = end
 
 
 class WaveformExtractor:
-    def __init__(self, filename):
-        # Load using FFmpeg through pydub
-        audio = AudioSegment.from_file(filename)
-        samples = np.array(audio.get_array_of_samples(), dtype=np.float32)
+    def __init__(self, filename, bin_size=BIN_SIZE, block_size=BLOCK_SIZE, progress=None):
+        """
+        Decode filename into an envelope. If given, progress is called with the
+        extractor after every block; decoding is aborted when it returns False.
+        """
+        self.bin_size = bin_size
+        self.progress = progress
+        self.finished = False
+        self.frames = 0
+        self.sample_rate = 0
+        self.duration = 0.0
+        self._set_channels(1)
+
+        Gst = gstreamer()
+        if Gst is not None:
+            self._decode(Gst, filename, block_size)
+        else:
+            self._decode_ffmpeg(filename, block_size)
+
+    @classmethod
+    def from_envelope(cls, mins, maxs, rms, sample_rate, duration, frames, bin_size=BIN_SIZE):
+        """
+        create an extractor from an already computed envelope, mins, maxs and
+        rms have one column per channel (a 1-d array is a single channel)
+        """
+        if mins.ndim == 1:
+            mins, maxs, rms = mins.reshape(-1, 1), maxs.reshape(-1, 1), rms.reshape(-1, 1)
+        return cls.from_pyramid([(mins, maxs, rms)], sample_rate, duration, frames, bin_size)
+
+    @classmethod
+    def from_pyramid(cls, levels, sample_rate, duration, frames, bin_size=BIN_SIZE):
+        """
+        create an extractor from the (mins, maxs, rms) levels of a pyramid,
+        the arrays are used as they are and never written to. Missing coarser
+        levels are built when they are needed.
+        """
+        extractor = cls.__new__(cls)
+        extractor.bin_size = bin_size
+        extractor.progress = None
+        extractor.finished = True
+        extractor.frames = frames
+        extractor.sample_rate = sample_rate
+        extractor.duration = duration
+        extractor._set_channels(levels[0][0].shape[1])
+        extractor._levels = [_Level(*level) for level in levels]
+        return extractor
+
+    @classmethod
+    def for_stream(cls, sample_rate, duration=0.0, bin_size=BIN_SIZE, channels=1):
+        """create an empty extractor, the caller passes the PCM to feed() and finish()"""
+        empty = np.empty((0, channels), dtype=np.int16)
+        extractor = cls.from_envelope(empty, empty, empty, sample_rate, duration, 0, bin_size)
+        extractor.finished = False
+        return extractor
+
+    def _set_channels(self, channels):
+        # only before the first block was fed
+        self.channels = channels
+        self._pending = np.empty((0, channels), dtype=np.int16)
+        self._levels = [_Level.empty(channels)]
+        self._combined = None
+
+    def snapshot(self):
+        """
+        return a frozen copy of the envelope decoded so far with its pyramid
+        built, it shares the bins with this extractor instead of copying them
+        """
+        copy = WaveformExtractor.from_pyramid(self.pyramid(), self.sample_rate,
+                self.duration, self.frames, self.bin_size)
+        copy.finished = self.finished
+        return copy
+
+    @trace.traced("decode")
+    def _decode(self, Gst, filename, block_size):
+        """stream filename through GStreamer as interleaved 16 bit PCM"""
+        pipeline = Gst.parse_launch("uridecodebin name=decoder ! audioconvert ! "
+                "%s ! appsink name=sink sync=false max-buffers=16" % DECODE_CAPS)
+        pipeline.get_by_name("decoder").set_property("uri",
+                Gst.filename_to_uri(os.path.abspath(filename)))
+        sink = pipeline.get_by_name("sink")
+        bus = pipeline.get_bus()
+        timeout = int(PULL_TIMEOUT * Gst.SECOND)
+        pipeline.set_state(Gst.State.PLAYING)
+        try:
+            block = None
+            filled = 0
+            while True:
+                # None at the end, but also when nothing reached the sink in
+                # time, e.g. because the file could not be decoded at all
+                sample = sink.emit("try-pull-sample", timeout)
+                if sample is None:
+                    message = bus.pop_filtered(Gst.MessageType.ERROR)
+                    if message is not None:
+                        error, debug = message.parse_error()
+                        raise IOError("could not decode %s: %s" % (filename, error.message))
+                    if sink.get_property("eos"):
+                        break
+                    if self.progress and self.progress(self) is False:
+                        break
+                    continue
+                if block is None:
+                    structure = sample.get_caps().get_structure(0)
+                    self.sample_rate = structure.get_value("rate")
+                    self._set_channels(structure.get_value("channels"))
+                    ok, duration = pipeline.query_duration(Gst.Format.TIME)
+                    if ok and duration > 0:
+                        self.duration = duration / Gst.SECOND
+                        self._reserve()
+                    # whole frames, so a block never ends in the middle of one
+                    block = np.empty(block_size // 2 // self.channels * self.channels,
+                            dtype=np.int16)
+
+                # the decoded memory is only viewed, it is copied once into the block
+                buffer = sample.get_buffer()
+                ok, info = buffer.map(Gst.MapFlags.READ)
+                if not ok:
+                    continue
+                fed = False
+                try:
+                    samples = np.frombuffer(info.data, dtype=np.int16)
+                    while samples.size:
+                        count = min(samples.size, block.size - filled)
+                        block[filled:filled + count] = samples[:count]
+                        samples = samples[count:]
+                        filled += count
+                        if filled == block.size:
+                            self.feed(block)
+                            filled = 0
+                            fed = True
+                finally:
+                    buffer.unmap(info)
+                if fed and self.progress and self.progress(self) is False:
+                    break
+            if filled:
+                self.feed(block[:filled])
+        finally:
+            pipeline.set_state(Gst.State.NULL)
+        self.finish()
+
+    @trace.traced("decode")
+    def _decode_ffmpeg(self, filename, block_size):
+        """stream filename through ffmpeg as interleaved 16 bit PCM"""
+        try:
+            from pydub import AudioSegment
+            from pydub.utils import mediainfo
+        except ImportError:
+            raise ImportError(
+                "Neither GStreamer nor pydub was found, install pydub with:\n"
+                "  pip install pydub\n"
+                "and ensure ffmpeg is installed (sudo apt install ffmpeg)")
+        info = mediainfo(filename)
+        self.sample_rate = int(info.get("sample_rate") or 0)
+        self.duration = float(info.get("duration") or 0)
+        self._set_channels(int(info.get("channels") or 1))
+        self._reserve()
+        block_size -= block_size % (2 * self.channels)
+
+        command = [
+            AudioSegment.converter, "-v", "error", "-nostdin",
+            "-i", filename, "-vn",
+            "-f", "s16le", "-acodec", "pcm_s16le", "-ac", str(self.channels), "-",
+        ]
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        cancelled = False
+        try:
+            while True:
+                block = process.stdout.read(block_size)
+                if not block:
+                    break
+                self.feed(block)
+                if self.progress and self.progress(self) is False:
+                    process.kill()
+                    cancelled = True
+                    break
+        finally:
+            process.stdout.close()
+            error = process.stderr.read()
+            process.stderr.close()
+            process.wait()
+        self.finish()
+
+        # a partly decoded file must not end up in the peak cache
+        if process.returncode != 0 and not cancelled:
+            raise IOError("ffmpeg could not decode %s: %s" % (
+                filename, error.decode("utf-8", "replace").strip()))
 
-        # Stereo → mono average
-        if audio.channels > 1:
-            samples = samples.reshape((-1, audio.channels))
-            samples = samples.mean(axis=1)
+    def feed(self, data):
+        """
+        fold a block of interleaved s16 PCM with whole frames of self.channels
+        samples into the envelope. data is a bytes-like object or an int16
+        array, it is only read and not kept.
+        """
+        frames = np.frombuffer(data, dtype=np.int16).reshape(-1, self.channels)
+        self.frames += len(frames)
+        if len(self._pending):
+            # complete the bin left over from the previous block
+            head = self.bin_size - len(self._pending)
+            self._pending = np.concatenate((self._pending, frames[:head]))
+            frames = frames[head:]
+            if len(self._pending) < self.bin_size:
+                return
+            self._fold(self._pending)
+
+        usable = len(frames) - len(frames) % self.bin_size
+        if usable:
+            self._fold(frames[:usable])
+        self._pending = frames[usable:].copy()
+
+    def _reserve(self):
+        """make room for the bins of the expected duration in the finest level"""
+        self._levels[0].reserve(int(self.duration * self.sample_rate / self.bin_size) + 1)
+
+    def _fold(self, frames):
+        """
+        append the per-channel min/max and RMS of whole bins of frames, min/max
+        are reduced in the native dtype
+        """
+        bins = frames.reshape(-1, self.bin_size, self.channels)
+        if self.channels > 1:
+            # reducing the contiguous frames of each channel is much faster
+            # than reducing across the interleaved ones
+            bins = np.ascontiguousarray(bins.transpose(0, 2, 1))
+        else:
+            bins = bins.reshape(-1, 1, self.bin_size)
+        self._levels[0].append(bins.min(axis=2), bins.max(axis=2), root_mean_square(bins))
+        self._combined = None
+
+    def finish(self):
+        """fold the samples of the last, incomplete bin"""
+        if len(self._pending):
+            pending = self._pending.T[None]
+            self._levels[0].append(pending.min(axis=2), pending.max(axis=2),
+                    root_mean_square(pending))
+            self._pending = self._pending[:0]
+            self._combined = None
+        self.finished = True
+
+    def loaded_fraction(self):
+        """estimate which fraction of the track has been decoded so far"""
+        expected = self.duration * self.sample_rate
+        if self.finished or expected <= 0:
+            return 1.0
+        return min(1.0, self.frames / expected)
+
+    def channel_envelope(self):
+        """
+        return the (mins, maxs, rms) arrays of all bins decoded so far, one
+        column per channel
+        """
+        return self._levels[0].bins()
+
+    def envelope(self):
+        """return the (mins, maxs) arrays of all bins decoded so far over all channels"""
+        if self._combined is None:
+            mins, maxs, rms = self.channel_envelope()
+            if self.channels == 1:
+                self._combined = (mins[:, 0], maxs[:, 0])
+            else:
+                self._combined = (mins.min(axis=1), maxs.max(axis=1))
+        return self._combined
+
+    def _extend_pyramid(self):
+        """
+        fold the pairs of bins added to every level since the last call into
+        the next coarser one, the bins folded before are not touched again
+        """
+        levels = self._levels
+        i = 0
+        while len(levels[i]) > MIN_LEVEL_SIZE or i + 1 < len(levels):
+            if i + 1 == len(levels):
+                levels.append(_Level.empty(self.channels))
+            level, parent = levels[i], levels[i + 1]
+            done = 2 * len(parent)
+            remaining = len(level) - done
+            if remaining > 1:
+                usable = done + remaining // 2 * 2
+                parent.append(*halve(*(array[done:usable] for array in level.bins())))
+            if self.finished and remaining > 0 and remaining % 2:
+                # nothing more is added, the odd last bin goes up alone
+                parent.append(*(array[-1:] for array in level.bins()))
+            i += 1
+
+    def pyramid(self):
+        """
+        return the list of (mins, maxs, rms) levels, each half the size of the
+        previous, with one column per channel. While decoding the coarser
+        levels can lack the last odd bin of the level below them.
+        """
+        self._extend_pyramid()
+        return [level.bins() for level in self._levels]
+
+    def peak(self):
+        """return the largest absolute amplitude of the envelope"""
+        self._extend_pyramid()
+        # every bin is either part of the coarsest level or the odd one out
+        # of a level that was not folded into the next one yet
+        peak = 0
+        for level, parent in zip(self._levels, self._levels[1:] + [None]):
+            mins, maxs, rms = level.bins()
+            if parent is not None:
+                mins, maxs = mins[2 * len(parent):], maxs[2 * len(parent):]
+            if len(mins):
+                peak = max(peak, -int(mins.min()), int(maxs.max()))
+        return peak
 
-        # Normalize to [-1, 1]
-        max_amp = np.max(np.abs(samples))
-        self.samples = samples / max_amp if max_amp > 0 else samples
-        self.sample_rate = audio.frame_rate
+    def _view_bins(self, start, end, columns):
+        """
+        return the pyramid level for columns over the fraction [start, end)
+        and the offsets of the first bin of every column into it, or None if
+        there is nothing to show
+        """
+        levels = self.pyramid()
+        total = len(levels[0][0])
+        if total == 0 or columns <= 0 or end <= start:
+            return None
 
+        bins_per_column = (end - start) * total / columns
+        level = int(np.log2(bins_per_column)) if bins_per_column >= 2 else 0
+        mins, maxs, rms = levels[min(level, len(levels) - 1)]
+
+        size = len(mins)
+        offsets = (np.linspace(start, end, columns, endpoint=False) * size).astype(np.intp)
+        np.clip(offsets, 0, size - 1, out=offsets)
+        first = offsets[0]
+        last = min(size, max(int(np.ceil(end * size)), offsets[-1] + 1))
+        offsets -= first
+        return (mins[first:last], maxs[first:last], rms[first:last]), offsets
+
+    @trace.traced("get_view")
+    def get_view(self, start, end, columns, channel=None):
+        """
+        Return normalised (mins, maxs) arrays with one entry per column for the
+        fraction [start, end) of the envelope of channel, or of all channels
+        if it is None. The values are read from the coarsest pyramid level
+        that still has at least one bin per column.
+        """
+        view = self._view_bins(start, end, columns)
+        if view is None:
+            empty = np.empty(0, dtype=np.float32)
+            return empty, empty
+        (mins, maxs, rms), offsets = view
+        if channel is not None:
+            mins, maxs = mins[:, channel], maxs[:, channel]
+        # each column reduces the bins up to the offset of the next column,
+        # columns sharing an offset all show that single bin
+        mins = np.minimum.reduceat(mins, offsets)
+        maxs = np.maximum.reduceat(maxs, offsets)
+        if channel is None and self.channels > 1:
+            mins, maxs = mins.min(axis=1), maxs.max(axis=1)
+        elif channel is None:
+            mins, maxs = mins[:, 0], maxs[:, 0]
+
+        peak = self.peak()
+        scale = np.float32(1.0 / peak if peak > 0 else 1.0)
+        return mins.astype(np.float32) * scale, maxs.astype(np.float32) * scale
+
+    @trace.traced("get_rms_view")
+    def get_rms_view(self, start, end, columns, channel=None):
+        """
+        Return the normalised RMS with one entry per column for the same
+        columns as get_view, the power of all channels is averaged if channel
+        is None.
+        """
+        view = self._view_bins(start, end, columns)
+        if view is None:
+            return np.empty(0, dtype=np.float32)
+        (mins, maxs, rms), offsets = view
+        if channel is not None:
+            rms = rms[:, channel, None]
+        power = np.square(rms, dtype=np.float32)
+        power = np.add.reduceat(power, offsets).mean(axis=1)
+        counts = np.diff(offsets, append=len(rms))
+        power /= np.maximum(counts, 1)
+
+        peak = self.peak()
+        return np.sqrt(power) * np.float32(1.0 / peak if peak > 0 else 1.0)
+
+    @trace.traced("get_samples")
     def get_samples(self, num_points=20000):
         """
         Return an interleaved min/max envelope array of roughly num_points length.
         This gives DAW-style visual richness.
         """
-        samples = self.samples
-        total = len(samples)
+        mins, maxs = self.envelope()
+        total = len(mins)
         if total == 0:
             return np.zeros(num_points, dtype=np.float32)
 
+        # Normalize to [-1, 1]; only the small envelope is converted to float
+        peak = max(-int(mins.min()), int(maxs.max()))
+        scale = 1.0 / peak if peak > 0 else 1.0
+
         # Compute window size; more points => more detail
         step = max(1, total // num_points)
-        trimmed = samples[: step * (total // step)]
-        reshaped = trimmed.reshape(-1, step)
-
-        # Get per-window min and max
-        mins = reshaped.min(axis=1)
-        maxs = reshaped.max(axis=1)
+        count = total // step
+        mins = mins[: step * count].reshape(-1, step).min(axis=1)
+        maxs = maxs[: step * count].reshape(-1, step).max(axis=1)
 
         # Interleave for drawing: [min0, max0, min1, max1, ...]
         out = np.empty(mins.size * 2, dtype=np.float32)
         out[0::2] = mins
         out[1::2] = maxs
+        out *= scale
 
         # Slight smoothing to make waveform more visually natural
         out = np.convolve(out, np.ones(3)/3, mode='same')
@@ -44,12 +44,12 @@ def ls_r(dir):
     return reduce(do_reduce, os.walk(dir), [])
 
 
-# Added in 2025: Waveform display feature (requires pydub, numpy, ffmpeg)
+# Added in 2025: Waveform display feature (requires numpy)
 kwargs = {
             'cmdclass': {'install': new_install},
             'name': 'playitslowly',
             'version': "1.5.1",
-            'description': 'A tool to help you when transcribing music. It allows you to play a piece of music at a different speed or pitch. Now includes a waveform display (requires pydub, numpy, ffmpeg).',
+            'description': 'A tool to help you when transcribing music. It allows you to play a piece of music at a different speed or pitch. Now includes a waveform display (requires numpy).',
             'author': 'Jonas Wagner',
             'author_email': 'jonas@29a.ch',
             'url': 'http://29a.ch/playitslowly/',
@@ -72,7 +72,7 @@ kwargs = {
                 'Programming Language :: Python',
                 ],
             # Not all distutils support install_requires, but document here:
-            # 'install_requires': ['pydub', 'numpy'],
+            # 'install_requires': ['numpy'],
 }
 
 try: